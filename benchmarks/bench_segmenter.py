@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Paw Segmenter Microbenchmarks
+Times the segmenter hot paths over generated corpora (pure CJK, mixed
+CJK/ASCII shell commands, punctuation-heavy text) from 10 B to 1 MB and
+compares the results with a stored baseline.
+
+Usage:
+  python3 benchmarks/bench_segmenter.py [--mode jieba|dict|fallback] [--quick]
+                                        [--engine jieba|mmap]
+                                        [--save] [--tolerance 0.5]
+                                        [--segmenter path/to/paw_segmenter.py]
+
+Every case runs with cold caches and the cyclic garbage collector off,
+at least 5 times and for --budget seconds. It reports min / p50 / mean /
+p99 latency and the tracemalloc peak of one extra run. get_word_boundaries
+cases also report the size of the entry the text cache keeps for that
+buffer. Only the fastest run gates latency, since scheduler noise can
+only make a run slower: a case fails when it exceeds the baseline's by
+more than --tolerance, or when its peak allocation or entry size does so
+by more than --alloc-tolerance. A fixed calibration workload (large dict
+lookups and small allocations, like jieba's inner loop) is timed right
+before and after every case and the average stored with it; the latency
+limit is scaled by how much slower or faster it runs now than when the
+baseline was taken, so a shared machine drifting in speed does not look
+like a regression. A case over the limit is measured once more, for
+three times the budget, and fails only if that is over it too; the exit
+status is then 1. Baselines are per machine: re-run with --save after an
+intended change or on new hardware. --engine mmap keeps its own baseline
+(baseline-mmap.json). Runs fully offline; --mode jieba and --mode dict
+need jieba installed.
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+
+SIZES = [
+    ("10B", 10),
+    ("100B", 100),
+    ("1KB", 1 << 10),
+    ("10KB", 10 << 10),
+    ("100KB", 100 << 10),
+    ("1MB", 1 << 20),
+]
+
+CJK_WORDS = [
+    "我们", "今天", "天气", "很好", "研究", "生命", "起源", "北京", "天安门",
+    "分词", "跳转", "光标", "终端", "命令", "修复", "问题", "然后", "再说",
+    "中华人民共和国", "的", "了", "在", "是", "一个", "测试", "性能", "提交",
+]
+SHELL_WORDS = [
+    "git", "commit", "-m", "curl", "-X", "POST", "https://example.com/api/v1",
+    "--data", "'{\"k\": 1}'", "&&", "|", "grep", "-rn", "ls", "-la", "~/src",
+    "docker", "run", "--rm", "python3", "-c", "echo", "$HOME", "make", "test",
+]
+PUNCT = list("，。！？、「」：；,.;:!?/\\'\"()[]{}<>@$^`~|*+=-_%&#")
+
+
+def _build(size, pick):
+    """生成 UTF-8 长度约为 size 字节的文本"""
+    parts, n = [], 0
+    while n < size:
+        w = pick()
+        parts.append(w)
+        n += len(w.encode("utf-8"))
+    text = "".join(parts)
+    while len(text.encode("utf-8")) > size and len(text) > 1:
+        text = text[:-1]
+    return text
+
+
+def make_corpora():
+    if make_corpora.cache:
+        return make_corpora.cache
+    rng = random.Random(20240101)
+    def cjk():
+        return rng.choice(CJK_WORDS)
+    def mixed():
+        r = rng.random()
+        if r < 0.45:
+            return rng.choice(SHELL_WORDS) + " "
+        if r < 0.9:
+            return rng.choice(CJK_WORDS)
+        return rng.choice("，。 ")
+    def punct():
+        return rng.choice(PUNCT) if rng.random() < 0.5 else rng.choice(CJK_WORDS + SHELL_WORDS)
+    make_corpora.cache = {
+        name: {label: _build(size, pick) for label, size in SIZES}
+        for name, pick in (("cjk", cjk), ("mixed", mixed), ("punct", punct))
+    }
+    return make_corpora.cache
+
+make_corpora.cache = None
+
+
+def load_segmenter(path):
+    spec = importlib.util.spec_from_file_location("paw_segmenter", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_cases(seg, mode, corpora, quick):
+    """(name, corpus, size, fn) 列表；fn 在冷缓存下执行一次被测操作"""
+    cases = []
+    for corpus, texts in corpora.items():
+        for label, _ in SIZES:
+            if quick and label == "1MB":
+                continue
+            text = texts[label]
+            mid = len(text) // 2
+            request = f"{text}\t{mid}\tnext_word"
+            cases += [
+                ("get_word_boundaries", corpus, label, lambda t=text: seg.get_word_boundaries(t)),
+                ("_fallback_boundaries", corpus, label, lambda t=text: seg._fallback_boundaries(t)),
+                ("next_word", corpus, label, lambda t=text, m=mid: seg.next_word(t, m)),
+                ("prev_word", corpus, label, lambda t=text, m=mid: seg.prev_word(t, m)),
+                ("handle_request", corpus, label, lambda r=request: seg.handle_request(r)),
+            ]
+            if mode != "fallback":
+                tokens = list(seg._jieba.cut(text, HMM=mode == "jieba"))
+                cases.append(
+                    ("_merge_jieba_tokens", corpus, label,
+                     lambda tk=tokens: seg._merge_jieba_tokens(tk)))
+    return cases
+
+
+def entry_size(obj):
+    """缓存条目（WordIndex）占用的字节数；字段是 list 时把其中的 int 对象也算上"""
+    size = sys.getsizeof(obj)
+    for name in getattr(type(obj), "__slots__", ()):
+        value = getattr(obj, name)
+        size += sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(x) for x in value if not -5 <= x <= 256)
+    return size
+
+
+def measure(seg, fn, budget, max_runs=1000, min_runs=5):
+    samples = []
+    # 与 timeit 一样关掉循环垃圾回收：大块分配触发的全量回收是主要的抖动来源
+    gc.collect()
+    gc.disable()
+    try:
+        deadline = time.perf_counter() + budget
+        while len(samples) < min_runs or (len(samples) < max_runs and time.perf_counter() < deadline):
+            seg.clear_caches()
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1000)
+    finally:
+        gc.enable()
+    samples.sort()
+    seg.clear_caches()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "runs": len(samples),
+        "min_ms": samples[0],
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        "peak_kb": peak / 1024,
+    }
+
+
+def run_case(seg, fn, budget):
+    """measure 加上前后两次校准的平均耗时"""
+    before = calibrate()
+    r = measure(seg, fn, budget)
+    r["calibration_ms"] = (before + calibrate()) / 2
+    return r
+
+
+def calibrate(rounds=8):
+    """固定的纯 Python 负载最快一次的耗时 ms，衡量机器当前的速度。
+    与 jieba 一样以大字典查找和切片分配为主，再加上正则扫描"""
+    if calibrate.state is None:
+        rng = random.Random(0)
+        text = "".join(rng.choice(CJK_WORDS + SHELL_WORDS + PUNCT) for _ in range(4000))
+        table = {f"{i:x}" * 2: i for i in range(300000)}
+        keys = [f"{rng.randrange(600000):x}" * 2 for _ in range(20000)]
+        calibrate.state = text, table, keys
+    text, table, keys = calibrate.state
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        sum(k in table for k in keys)
+        {i: (text[i:i + 2], text[i:i + 4]) for i in range(len(text) - 4)}
+        [m.end() for m in re.finditer(r"\w+|\W", text)]
+        best = min(best, (time.perf_counter() - t0) * 1000)
+    return best
+
+
+calibrate.state = None
+
+
+def compare(result, base, tolerance, alloc_tolerance):
+    """返回回归说明列表，空列表表示通过"""
+    problems = []
+    # 机器当前相对录基线时的耗时比例
+    speed = 1.0
+    if base.get("calibration_ms") and result.get("calibration_ms"):
+        speed = result["calibration_ms"] / base["calibration_ms"]
+    # 旧基线没有 min_ms 时退回 p50
+    key = "min_ms" if "min_ms" in base else "p50_ms"
+    # 亚毫秒级的抖动不算回归
+    limit = base[key] * speed * (1 + tolerance) + 0.05
+    if result[key] > limit:
+        problems.append(f"{key} {result[key]:.3f} > {limit:.3f}")
+    for key in ("peak_kb", "entry_kb"):
+        if key not in base or key not in result:
+            continue
+        limit = base[key] * (1 + alloc_tolerance) + 1
+        if result[key] > limit:
+            problems.append(f"{key} {result[key]:.1f} > {limit:.1f}")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--mode", choices=("jieba", "dict", "fallback"), default="jieba")
+    ap.add_argument("--quick", action="store_true", help="skip the 1MB corpora")
+    ap.add_argument("--engine", choices=("jieba", "mmap"), default="jieba",
+                    help="segmentation engine for --mode jieba / dict")
+    ap.add_argument("--save", action="store_true", help="write results as the new baseline")
+    ap.add_argument("--baseline", type=Path, help="baseline file (default: benchmarks/baseline-<mode>.json)")
+    ap.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown (default 0.5)")
+    ap.add_argument("--alloc-tolerance", type=float, default=0.2, help="allowed relative peak allocation growth")
+    ap.add_argument("--budget", type=float, default=0.3, help="seconds spent per case (default 0.3)")
+    ap.add_argument("--filter", default="", help="only run cases whose name contains this")
+    ap.add_argument("--segmenter", type=Path, default=REPO_DIR / "paw_segmenter.py")
+    args = ap.parse_args()
+
+    seg = load_segmenter(args.segmenter)
+    if args.mode != "fallback":
+        try:
+            import jieba
+        except ImportError:
+            sys.exit("jieba is not installed; use --mode fallback")
+        jieba.setLogLevel(60)
+        seg.configure({"segmenter": {"engine": args.engine, "mode": args.mode}})
+        seg._jieba = seg.init_jieba()
+    else:
+        seg._jieba = None
+
+    name = "mmap" if args.mode == "jieba" and args.engine == "mmap" else args.mode
+    baseline_path = args.baseline or BENCH_DIR / f"baseline-{name}.json"
+    baseline = {}
+    if baseline_path.exists() and not args.save:
+        baseline = json.loads(baseline_path.read_text())["results"]
+
+    results = {}
+    regressions = 0
+    print(f"{'case':<44}{'runs':>6}{'min ms':>11}{'p50 ms':>11}{'mean ms':>11}{'p99 ms':>11}{'peak KB':>10}")
+    for name, corpus, label, fn in build_cases(seg, args.mode, make_corpora(), args.quick):
+        key = f"{name}/{corpus}/{label}"
+        if args.filter not in key:
+            continue
+        r = run_case(seg, fn, args.budget)
+        problems = compare(r, baseline[key], args.tolerance, args.alloc_tolerance) if key in baseline else []
+        if problems:
+            # 一次超限可能只是机器恰好慢了一阵，用更长的时间再测一次确认
+            retry = run_case(seg, fn, args.budget * 3)
+            if retry["min_ms"] < r["min_ms"]:
+                r = retry
+            problems = compare(r, baseline[key], args.tolerance, args.alloc_tolerance)
+        if name == "get_word_boundaries":
+            r["entry_kb"] = entry_size(seg.word_index(make_corpora.cache[corpus][label])) / 1024
+        results[key] = r
+        line = (f"{key:<44}{r['runs']:>6}{r['min_ms']:>11.3f}{r['p50_ms']:>11.3f}"
+                f"{r['mean_ms']:>11.3f}{r['p99_ms']:>11.3f}{r['peak_kb']:>10.1f}")
+        if "entry_kb" in r:
+            line += f"  entry {r['entry_kb']:.1f} KB"
+        if problems:
+            regressions += 1
+            line += "  REGRESSION: " + "; ".join(problems)
+        print(line, flush=True)
+
+    if args.save:
+        baseline_path.write_text(json.dumps({
+            "meta": {
+                "mode": args.mode,
+                "engine": args.engine if args.mode != "fallback" else None,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+            },
+            "results": {k: {f: round(v, 4) for f, v in r.items()} for k, r in results.items()},
+        }, indent=1, sort_keys=True) + "\n")
+        print(f"\nbaseline written to {baseline_path}")
+    elif not baseline:
+        print(f"\nno baseline at {baseline_path}; run with --save to create one")
+    if regressions:
+        print(f"\n{regressions} case(s) regressed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
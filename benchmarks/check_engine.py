@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Paw Segmenter Engine Equivalence Check
+Proves that the memory-mapped dictionary engine ("engine": "mmap") cuts
+text exactly like jieba itself. It compares the raw jieba.cut word lists
+(with and without HMM) and the merged word boundaries over the benchmark
+corpora, over random mixed text, and over every line of jieba's own
+dict.txt read as text, and it checks that user-dictionary edits applied
+to both engines keep them in step.
+
+Usage:
+  python3 benchmarks/check_engine.py [--samples 3000] [--seed 0]
+                                     [--dict /tmp/paw-dict.bin]
+
+Needs jieba. The compiled dictionary goes to --dict (a temporary file by
+default), so this does not touch ~/.config/paw/dict.bin. Exits 1 on the
+first difference.
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from bench_segmenter import REPO_DIR, make_corpora, load_segmenter  # noqa: E402
+
+ALPHABET = (
+    list("我爱北京天安门今天天气很好研究生命的起源和服务器部署上线") +
+    ["中华人民共和国", "python3", "git", "a.b", "c++", "-m", "100%", "#", "&",
+     "_x", "\r\n", "😀", "かな", "é", "ｆ", "〇", "㐀", "工信处女干事", "每月经过下属科室"] +
+    list(" \t\n，。！？、「」：；,.;:!?/\\'\"()[]{}<>@$^`~|*+=-_%&#")
+)
+
+
+def texts(samples, seed, jieba):
+    for corpus in make_corpora().values():
+        for label, text in corpus.items():
+            if label != "1MB":
+                yield text
+    rng = random.Random(seed)
+    for _ in range(samples):
+        yield "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 60)))
+    # 词典里的词两两拼接，专门覆盖词典边界上的 DAG 选择
+    with open(Path(jieba.__file__).parent / jieba.DEFAULT_DICT_NAME, encoding="utf-8") as f:
+        words = [line.split(" ")[0] for line in f]
+    for i in range(0, len(words) - 1, 7):
+        yield words[i] + words[i + 1] + words[rng.randrange(len(words))]
+
+
+def compare(seg, jieba, engine, text):
+    for hmm in (True, False):
+        a = list(jieba.cut(text, HMM=hmm))
+        b = list(engine.cut(text, HMM=hmm))
+        if a != b:
+            return f"cut(HMM={hmm}) differs: {a!r} != {b!r}"
+    seg._jieba = jieba
+    a = seg._jieba_boundaries(text)
+    seg._jieba = engine
+    b = seg._jieba_boundaries(text)
+    if a != b:
+        return f"boundaries differ: {list(a)} != {list(b)}"
+    return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--samples", type=int, default=3000, help="random texts to compare")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--dict", type=Path, help="where to compile dict.bin (default: a temp file)")
+    ap.add_argument("--segmenter", type=Path, default=REPO_DIR / "paw_segmenter.py")
+    args = ap.parse_args()
+
+    seg = load_segmenter(args.segmenter)
+    seg.configure({"segmenter": {"clause_cache_size": 0}})
+    import jieba
+    jieba.setLogLevel(60)
+    jieba.initialize()
+
+    path = args.dict or Path(tempfile.mkdtemp()) / "dict.bin"
+    t0 = time.perf_counter()
+    seg.compile_dict(jieba, str(path))
+    print(f"compiled {path} ({path.stat().st_size / 1e6:.1f} MB) in {time.perf_counter() - t0:.2f}s")
+    engine = seg.load_mmap_engine(jieba, str(path))
+    if engine.total != jieba.dt.total:
+        sys.exit(f"total differs: {engine.total} != {jieba.dt.total}")
+
+    n = 0
+    for text in texts(args.samples, args.seed, jieba):
+        problem = compare(seg, jieba, engine, text)
+        if problem:
+            print(f"MISMATCH on {text!r}: {problem}")
+            sys.exit(1)
+        n += 1
+    print(f"{n} texts identical")
+
+    # 用户词典：两边各自应用同一份改动，再比较
+    edits = [("服务器部署", 100, None), ("天安门今天", None, None), ("北京", 0, None)]
+    for target in (jieba, engine):
+        ud = seg.UserDict("/nonexistent")
+        for word, freq, tag in edits:
+            ud._add(target, word, freq, tag)
+    for text in ["服务器部署上线", "我爱北京天安门今天天气很好", "北京欢迎你"] + ALPHABET:
+        problem = compare(seg, jieba, engine, text)
+        if problem:
+            print(f"MISMATCH after user dictionary edits on {text!r}: {problem}")
+            sys.exit(1)
+    print("user dictionary edits identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Paw Segmenter Mode Comparison
+Reports, for each segmentation mode (jieba, dict, fallback), the cold-cache
+latency of get_word_boundaries and how closely its boundaries agree with
+the full jieba mode (dictionary + HMM) on the benchmark corpora.
+
+Usage:
+  python3 benchmarks/compare_modes.py [--quick] [--engine jieba|mmap]
+                                      [--json report.json]
+
+Agreement is measured two ways against jieba mode:
+  boundaries  shared word ends / all word ends (Jaccard index)
+  jumps       share of cursor positions where next_word and prev_word
+              both land where jieba mode would put them
+Needs jieba.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from bench_segmenter import REPO_DIR, SIZES, make_corpora, load_segmenter, measure  # noqa: E402
+
+MODES = ("jieba", "dict", "fallback")
+
+
+def agreement(seg, text, mode, ref):
+    ends = set(seg.word_index(text, mode).ends)
+    ref_ends = set(ref.ends)
+    union = ends | ref_ends
+    boundaries = len(ends & ref_ends) / len(union) if union else 1.0
+    # 最多取 2000 个光标位置，长文本均匀抽样
+    step = max(1, len(text) // 2000)
+    positions = range(0, len(text) + 1, step)
+    index = seg.word_index(text, mode)
+    same = 0
+    for pos in positions:
+        end, ref_end = index.next_end(pos), ref.next_end(pos)
+        start, ref_start = index.prev_start(pos), ref.prev_start(pos)
+        same += end == ref_end and start == ref_start
+    return boundaries, same / len(positions)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--quick", action="store_true", help="stop at 10KB")
+    ap.add_argument("--engine", choices=("jieba", "mmap"), default="jieba")
+    ap.add_argument("--budget", type=float, default=0.3, help="seconds spent per case (default 0.3)")
+    ap.add_argument("--json", type=Path, help="also write the report as JSON")
+    ap.add_argument("--segmenter", type=Path, default=REPO_DIR / "paw_segmenter.py")
+    args = ap.parse_args()
+
+    seg = load_segmenter(args.segmenter)
+    try:
+        import jieba
+    except ImportError:
+        sys.exit("jieba is not installed")
+    jieba.setLogLevel(60)
+    seg.configure({"segmenter": {"engine": args.engine}})
+    seg._jieba = seg.init_jieba()
+
+    labels = [label for label, _ in SIZES if label != "1MB" and not (args.quick and label == "100KB")]
+    report = {}
+    print(f"{'corpus/size':<16}{'mode':<10}{'mean ms':>10}{'p50 ms':>10}{'vs jieba':>10}"
+          f"{'boundaries':>12}{'jumps':>8}")
+    for corpus, texts in make_corpora().items():
+        for label in labels:
+            text = texts[label]
+            ref = seg.word_index(text, "jieba")
+            base_ms = None
+            for mode in MODES:
+                r = measure(seg, lambda m=mode: seg.get_word_boundaries(text, m), args.budget)
+                base_ms = base_ms or r["mean_ms"]
+                boundaries, jumps = agreement(seg, text, mode, ref)
+                report[f"{corpus}/{label}/{mode}"] = {
+                    "mean_ms": round(r["mean_ms"], 4),
+                    "p50_ms": round(r["p50_ms"], 4),
+                    "boundary_agreement": round(boundaries, 4),
+                    "jump_agreement": round(jumps, 4),
+                }
+                print(f"{corpus + '/' + label:<16}{mode:<10}{r['mean_ms']:>10.3f}{r['p50_ms']:>10.3f}"
+                      f"{r['mean_ms'] / base_ms:>9.2f}x{boundaries:>11.1%}{jumps:>8.1%}", flush=True)
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=1, sort_keys=True) + "\n")
+        print(f"\nreport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
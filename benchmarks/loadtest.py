@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Paw Segmenter Load Test
+Simulates N concurrent shells talking to one paw_segmenter daemon over its
+Unix socket with the real protocol, and reports throughput, tail latency,
+connection errors and daemon RSS over time.
+
+Usage:
+  python3 benchmarks/loadtest.py [--clients 100] [--duration 30]
+                                 [--think-ms 300] [--protocol v2]
+                                 [--spawn [--processes 0] [--mode jieba]
+                                          [--max-connections N] [--backlog N]]
+                                 [--json report.json]
+
+Each client keeps one connection open like the zsh widget does (v2 frames;
+--protocol keepalive or oneshot for the older clients), reconnects after
+an error, and waits an exponentially distributed think time between
+requests. A client edits its buffer now and then (--new-buffer) and
+otherwise re-queries the same one, so the daemon's caches see a realistic
+mix of hits and misses. Buffers are slices of the bench_segmenter corpora:
+mostly one-line commands, some pasted paragraphs, a few 1-10 KB pastes.
+Requests are mostly "boundaries" (what the widget sends once per buffer
+change) with some next_word / prev_word / delete_word.
+
+Without --spawn it targets the daemon already listening on --socket
+(default ~/.config/paw/paw.sock). --spawn starts a private daemon with a
+temporary HOME and the given config, waits for it (and for jieba) to be
+ready, and stops it afterwards. The daemon keeps its own max_connections
+and backlog defaults unless --max-connections / --backlog are given, so
+a run with more clients than the limit shows what real shells would see.
+A connection the daemon accepts but does not ack ("error: busy", evicted,
+or no reply within --timeout) counts as an error. RSS is read from /proc for the pid in the
+daemon's pid file plus its pre-fork workers, summed (Linux only). Runs
+fully offline.
+"""
+
+import argparse
+import json
+import os
+import random
+import select
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from bench_segmenter import REPO_DIR, make_corpora  # noqa: E402
+
+ACTIONS = ("boundaries", "next_word", "prev_word", "delete_word")
+ACTION_WEIGHTS = (0.7, 0.1, 0.1, 0.1)
+# (最短, 最长, 占比)：单行命令为主，偶尔粘贴段落或大块文本
+BUFFER_SIZES = ((10, 120, 0.8), (120, 1000, 0.15), (1000, 10000, 0.05))
+
+
+def pick_buffer(rng, sources):
+    lo, hi, _ = rng.choices(BUFFER_SIZES, [w for _, _, w in BUFFER_SIZES])[0]
+    source = rng.choice(sources)
+    size = rng.randint(lo, hi)
+    start = rng.randrange(len(source) - size)
+    return source[start:start + size]
+
+
+class HandshakeError(ConnectionError):
+    """daemon 接受了连接，但没有回应握手"""
+
+
+class Connection:
+    """按 protocol 说话的一条客户端连接；oneshot 每个请求重新连接"""
+
+    def __init__(self, path, protocol, timeout):
+        self.path, self.protocol, self.timeout = path, protocol, timeout
+        self.sock = self.reader = None
+        if protocol != "oneshot":
+            self._open()
+            hello, ack = {"v2": (b"PAW v2\n", b"OK v2\n"),
+                          "keepalive": (b"PAW keepalive\n", b"OK keepalive\n")}[protocol]
+            try:
+                self.sock.sendall(hello)
+                reply = self.reader.readline()
+            except OSError:
+                reply = b""
+            if reply != ack:
+                self.close()
+                raise HandshakeError(reply.decode("utf-8", "replace").strip() or "no ack")
+
+    def _open(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        try:
+            self.sock.connect(self.path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.reader = self.sock.makefile("rb")
+
+    def request(self, text, pos, action):
+        if self.protocol == "v2":
+            body = text.encode("utf-8")
+            self.sock.sendall(f"{len(body)}\t{pos}\t{action}\n".encode("ascii") + body)
+        else:
+            if self.protocol == "oneshot":
+                self._open()
+            # 行协议里文本不能含制表符和换行
+            line = text.replace("\t", " ").replace("\n", " ")
+            self.sock.sendall(f"{line}\t{pos}\t{action}\n".encode("utf-8"))
+        reply = self.reader.readline()
+        if self.protocol == "oneshot":
+            self.close()
+        if not reply.endswith(b"\n"):
+            raise ConnectionError("connection closed by daemon")
+        return reply.decode("utf-8").rstrip("\n")
+
+    def close(self):
+        for f in (self.reader, self.sock):
+            try: f.close()
+            except: pass
+        self.sock = self.reader = None
+
+
+class Recorder:
+    """线程共享的计数器；每个统计窗口结束时由主线程取走当期数据"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.window = []
+        self.errors = Counter()
+        self.window_errors = 0
+        self.connected = 0
+
+    def ok(self, ms):
+        with self.lock:
+            self.window.append(ms)
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+            self.window_errors += 1
+
+    def take(self):
+        with self.lock:
+            window, errors = self.window, self.window_errors
+            self.window, self.window_errors = [], 0
+            self.latencies += window
+        return window, errors
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))], 4)
+
+
+def cell(value, spec, width=9):
+    return f"{'-' if value is None else format(value, spec):>{width}}"
+
+
+def run_client(cid, args, sources, stop, rec):
+    rng = random.Random(args.seed * 100003 + cid)
+    conn = None
+    text = pick_buffer(rng, sources)
+    # 启动时错开，避免所有客户端同一时刻建连
+    if stop.wait(rng.uniform(0, args.ramp)):
+        return
+    while not stop.is_set():
+        if rng.random() < args.new_buffer:
+            text = pick_buffer(rng, sources)
+        pos = rng.randint(0, len(text))
+        action = rng.choices(ACTIONS, ACTION_WEIGHTS)[0]
+        t0 = time.perf_counter()
+        try:
+            if conn is None:
+                conn = Connection(args.socket, args.protocol, args.timeout)
+                with rec.lock:
+                    rec.connected += 1
+            reply = conn.request(text, pos, action)
+            if reply.startswith("error"):
+                rec.error("error reply")
+            else:
+                rec.ok((time.perf_counter() - t0) * 1000)
+        except HandshakeError as e:
+            rec.error(f"handshake: {e}")
+        except (OSError, ConnectionError) as e:
+            rec.error(type(e).__name__)
+            if conn is not None:
+                conn.close()
+                conn = None
+                with rec.lock:
+                    rec.connected -= 1
+        stop.wait(rng.expovariate(1000 / args.think_ms) if args.think_ms > 0 else 0)
+    if conn is not None:
+        conn.close()
+
+
+def daemon_pids(pid_file):
+    """pid 文件里的 daemon 及其 pre-fork worker"""
+    try:
+        pid = int(Path(pid_file).read_text().strip())
+    except (OSError, ValueError):
+        return []
+    pids = [pid]
+    try:
+        pids += [int(p) for p in Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+    except OSError:
+        pass
+    return pids
+
+
+def rss_mb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            pass
+    return round(total / 1024, 1) if total else None
+
+
+def query(path, action, timeout=2.0):
+    """发一个一问一答请求；daemon 不可用时返回 None"""
+    try:
+        conn = Connection(path, "oneshot", timeout)
+        return conn.request("", 0, action)
+    except (OSError, ConnectionError):
+        return None
+
+
+def spawn_daemon(args):
+    """在临时 HOME 下启动一个私有 daemon，等 socket 就绪、jieba 加载完成"""
+    home = tempfile.mkdtemp(prefix="paw-load-")
+    config_dir = Path(home) / ".config" / "paw"
+    config_dir.mkdir(parents=True)
+    config = {"processes": args.processes, "mode": args.mode, "engine": args.engine}
+    if args.max_connections is not None:
+        config["max_connections"] = args.max_connections
+    if args.backlog is not None:
+        config["backlog"] = args.backlog
+    (config_dir / "config.json").write_text(json.dumps({"segmenter": config}))
+    rfd, wfd = os.pipe()
+    proc = subprocess.Popen(
+        [args.python, str(args.segmenter), "--ready-fd", str(wfd)],
+        env={**os.environ, "HOME": home}, pass_fds=(wfd,),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(wfd)
+    try:
+        ready = select.select([rfd], [], [], 60)[0] and os.read(rfd, 64)
+    finally:
+        os.close(rfd)
+    if not ready or not ready.startswith(b"ready"):
+        proc.kill()
+        shutil.rmtree(home, ignore_errors=True)
+        sys.exit("daemon did not become ready")
+    path = str(config_dir / "paw.sock")
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        st = query(path, "stats")
+        if st and json.loads(st)["jieba"] != "loading":
+            break
+        time.sleep(0.1)
+    return proc, home, path
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--clients", type=int, default=100, help="concurrent clients (default 100)")
+    ap.add_argument("--duration", type=float, default=30, help="seconds to run (default 30)")
+    ap.add_argument("--think-ms", type=float, default=300, help="mean think time per client (default 300)")
+    ap.add_argument("--new-buffer", type=float, default=0.3,
+                    help="chance that a request comes with an edited buffer (default 0.3)")
+    ap.add_argument("--protocol", choices=("v2", "keepalive", "oneshot"), default="v2")
+    ap.add_argument("--timeout", type=float, default=5.0, help="client socket timeout in seconds")
+    ap.add_argument("--ramp", type=float, default=2.0, help="spread client start-up over this many seconds")
+    ap.add_argument("--interval", type=float, default=1.0, help="report interval in seconds")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--socket", default=os.path.expanduser("~/.config/paw/paw.sock"))
+    ap.add_argument("--spawn", action="store_true", help="start a private daemon for the run")
+    ap.add_argument("--processes", type=int, default=0, help="with --spawn: pre-fork workers")
+    ap.add_argument("--mode", choices=("jieba", "dict", "fallback"), default="jieba", help="with --spawn")
+    ap.add_argument("--engine", choices=("jieba", "mmap"), default="jieba", help="with --spawn")
+    ap.add_argument("--max-connections", type=int,
+                    help="with --spawn: override the daemon's max_connections (default: its own)")
+    ap.add_argument("--backlog", type=int,
+                    help="with --spawn: override the daemon's listen backlog (default: its own)")
+    ap.add_argument("--python", default=sys.executable, help="with --spawn: interpreter for the daemon")
+    ap.add_argument("--segmenter", type=Path, default=REPO_DIR / "paw_segmenter.py")
+    ap.add_argument("--json", type=Path, help="also write the report as JSON")
+    args = ap.parse_args()
+
+    proc = home = None
+    if args.spawn:
+        proc, home, args.socket = spawn_daemon(args)
+    elif query(args.socket, "stats") is None:
+        sys.exit(f"no daemon on {args.socket}; start one or use --spawn")
+    pid_file = str(Path(args.socket).with_name("paw.pid"))
+
+    sources = [texts["100KB"] for texts in make_corpora().values()]
+    rec = Recorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_client, args=(i, args, sources, stop, rec), daemon=True)
+               for i in range(args.clients)]
+    timeline = []
+    try:
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        print(f"{'t s':>6}{'conns':>7}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'RSS MB':>9}")
+        next_tick = start + args.interval
+        while next_tick <= start + args.duration:
+            time.sleep(max(0, next_tick - time.monotonic()))
+            window, errors = rec.take()
+            point = {
+                "t": round(next_tick - start, 1),
+                "connections": rec.connected,
+                "rps": round(len(window) / args.interval, 1),
+                "p50_ms": percentile(window, 0.5),
+                "p99_ms": percentile(window, 0.99),
+                "errors": errors,
+                "rss_mb": rss_mb(daemon_pids(pid_file)),
+            }
+            timeline.append(point)
+            print(f"{point['t']:>6.1f}{point['connections']:>7}{point['rps']:>9.1f}"
+                  f"{cell(point['p50_ms'], '.2f')}{cell(point['p99_ms'], '.2f')}"
+                  f"{errors:>8}{cell(point['rss_mb'], '.1f')}", flush=True)
+            next_tick += args.interval
+        stop.set()
+        for t in threads:
+            t.join(args.timeout + 1)
+        elapsed = time.monotonic() - start
+        rec.take()
+        st = query(args.socket, "stats")
+    finally:
+        stop.set()
+        if proc is not None:
+            proc.terminate()
+            try: proc.wait(10)
+            except subprocess.TimeoutExpired: proc.kill()
+            shutil.rmtree(home, ignore_errors=True)
+
+    lat = rec.latencies
+    rss = [p["rss_mb"] for p in timeline if p["rss_mb"] is not None]
+    summary = {
+        "clients": args.clients,
+        "protocol": args.protocol,
+        "requests": len(lat),
+        "throughput_rps": round(len(lat) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(lat), 4) if lat else None,
+        "p50_ms": percentile(lat, 0.5),
+        "p90_ms": percentile(lat, 0.9),
+        "p99_ms": percentile(lat, 0.99),
+        "p999_ms": percentile(lat, 0.999),
+        "max_ms": round(max(lat), 4) if lat else None,
+        "errors": dict(rec.errors),
+        "rss_mb_start": rss[0] if rss else None,
+        "rss_mb_peak": max(rss) if rss else None,
+        "rss_mb_end": rss[-1] if rss else None,
+    }
+    if st:
+        cache = json.loads(st)["cache"]
+        summary["cache_hit_rate"] = cache.get("hit_rate")
+        summary["clause_cache_hit_rate"] = cache.get("clause_hit_rate")
+
+    print()
+    for key, value in summary.items():
+        if isinstance(value, float):
+            value = f"{value:.3f}" if key.endswith("_ms") else f"{value:g}"
+        print(f"{key:<24}{value}")
+
+    if args.json:
+        args.json.write_text(json.dumps({"summary": summary, "timeline": timeline},
+                                        indent=1, sort_keys=True) + "\n")
+        print(f"\nreport written to {args.json}")
+    if rec.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Paw Segmenter Trace Replay
+Replays a request trace recorded by the daemon ("trace": true in the
+segmenter config) against one or more builds of paw_segmenter.py, and
+compares their latency and their results.
+
+Usage:
+  python3 benchmarks/replay.py ~/.config/paw/traces/trace.jsonl*
+                               [--segmenter path/to/paw_segmenter.py ...]
+                               [--repeat 3] [--engine jieba|mmap]
+                               [--userdict ~/.config/paw/userdict.txt]
+                               [--json report.json]
+
+The daemon writes each distinct buffer once per trace file and refers to
+it by text_id afterwards; read_trace puts the text back. Requests replay
+in recording order, with the caches carried from one request to the next
+as in the daemon, so a real editing session exercises the caches the way
+it did live. Each request uses the mode recorded for it. The whole trace runs --repeat times per build with the caches cleared
+(or the build reloaded) in between, and each request keeps its fastest
+run.
+
+Builds are driven through what each one has: dispatch() when it exists,
+otherwise handle_request() with the request line the daemon would have
+received (tabs and newlines in the buffer become spaces there). configure,
+clear_caches, per-request modes and the user dictionary are used only
+where the build supports them; a build without per-request modes replays
+only the records in the mode it serves; those and any action the build
+does not know are counted as skipped. Results are checked
+against the recorded ones (records from redacted traces carry a result
+only in fallback mode) and, with several --segmenter builds, against the
+first build. Latency is reported per action next to the latency recorded
+live; the "vs" column is the ratio of total replay time to the first
+build, shown where both replayed the same requests. Exits 1 on any result mismatch. Needs jieba unless every record is
+in fallback mode.
+"""
+
+import argparse
+import inspect
+import json
+import statistics
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from zlib import crc32
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from bench_segmenter import REPO_DIR, load_segmenter  # noqa: E402
+
+USERDICT = Path.home() / ".config" / "paw" / "userdict.txt"
+
+
+def read_trace(paths):
+    """读入各 trace 文件（含滚动出的 .1/.2），按记录时间排序。
+    每个缓冲区在文件里只有第一次出现时带全文，之后的记录按 text_id 引用它"""
+    records = []
+    for path in paths:
+        texts = {}
+        with open(path, encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                r = json.loads(line)
+                if "text" in r:
+                    if "text_id" in r:
+                        texts[r["text_id"]] = r["text"]
+                elif r.get("text_id") in texts:
+                    r["text"] = texts[r["text_id"]]
+                else:
+                    sys.exit(f"{path}:{n}: text {r.get('text_id')} is not defined earlier in the file")
+                records.append(r)
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def setup(build, records, engine, userdict):
+    """载入并配置一个版本；旧版本没有的接口一概跳过"""
+    seg = load_segmenter(build)
+    if hasattr(seg, "configure"):
+        seg.configure({"segmenter": {"engine": engine}})
+    elif engine != "jieba":
+        sys.exit(f"{build} has no configure(), so it cannot use --engine {engine}")
+    if any(r["mode"] != "fallback" for r in records):
+        try:
+            import jieba
+        except ImportError:
+            sys.exit("jieba is not installed, but the trace has jieba-mode records")
+        jieba.setLogLevel(60)
+        seg._jieba = seg.init_jieba()
+        if userdict and userdict.exists() and hasattr(seg, "UserDict"):
+            seg._userdict = seg.UserDict(str(userdict))
+            seg._userdict.poll(seg._jieba)
+    else:
+        seg._jieba = None
+    return seg
+
+
+def per_request_mode(seg):
+    """该版本是否支持按请求选择模式（serving_mode 接受所请求的模式）"""
+    try:
+        return bool(inspect.signature(seg.serving_mode).parameters)
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+
+def serves(seg, record):
+    """该版本能否按记录的模式回放这条请求"""
+    if per_request_mode(seg):
+        return True
+    return record["mode"] == ("jieba" if seg._jieba else "fallback")
+
+
+def request_fn(seg):
+    """返回 fn(record) → 结果；有 dispatch 就直接调用，否则走 handle_request"""
+    with_mode = per_request_mode(seg)
+    if hasattr(seg, "dispatch"):
+        def run(r):
+            options = dict(r.get("options") or {})
+            if with_mode:
+                options["mode"] = r["mode"]
+            return seg.dispatch(r["text"], r["pos"], r["action"], options)
+        return run
+    with_options = hasattr(seg, "_parse_options")
+    def run(r):
+        # 行协议里文本不能含制表符和换行
+        line = f"{r['text'].replace(chr(9), ' ').replace(chr(10), ' ')}\t{r['pos']}\t{r['action']}"
+        options = dict(r.get("options") or {})
+        if with_options and options:
+            line += "\t" + ",".join(k if v is True else f"{k}={v}" for k, v in options.items())
+        return seg.handle_request(line)
+    return run
+
+
+def replay(build, records, repeat, engine, userdict):
+    """返回 (各请求最快一次的耗时 ms, 各请求的结果)；跳过的请求两者均为 None"""
+    seg = setup(build, records, engine, userdict)
+    todo = [i for i, r in enumerate(records) if serves(seg, r)]
+    best = [None] * len(records)
+    results = [None] * len(records)
+    for n in range(repeat):
+        if n:
+            if hasattr(seg, "clear_caches"):
+                seg.clear_caches()
+            else:
+                seg = setup(build, records, engine, userdict)
+        run = request_fn(seg)
+        for i in todo:
+            t0 = time.perf_counter()
+            results[i] = run(records[i])
+            ms = (time.perf_counter() - t0) * 1000
+            best[i] = ms if best[i] is None else min(best[i], ms)
+    # 旧版本还没有的动作（如 boundaries）按跳过计，不算结果不一致
+    for i in todo:
+        if results[i].startswith("error: unknown action"):
+            best[i] = results[i] = None
+    return best, results
+
+
+def matches(record, result):
+    """结果与 trace 记录的是否一致；记录里没有结果时返回 None"""
+    if "result" in record:
+        return result == record["result"]
+    if "result_crc32" in record:
+        return crc32(result.encode("utf-8")) == record["result_crc32"]
+    return None
+
+
+def summarize(records, latencies):
+    by_action = defaultdict(list)
+    for r, ms in zip(records, latencies):
+        if ms is not None:
+            by_action[r["action"].partition(":")[0]].append(ms)
+    by_action["all"] = [ms for ms in latencies if ms is not None]
+    summary = {}
+    for action, samples in by_action.items():
+        if not samples:
+            continue
+        samples.sort()
+        summary[action] = {
+            "count": len(samples),
+            "mean_ms": round(statistics.fmean(samples), 4),
+            "p50_ms": round(samples[len(samples) // 2], 4),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 4),
+            "total_ms": round(sum(samples), 4),
+        }
+    return summary
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("trace", type=Path, nargs="+", help="trace file(s)")
+    ap.add_argument("--segmenter", type=Path, action="append",
+                    help="build to replay against; repeat to compare builds (default: this repo)")
+    ap.add_argument("--repeat", type=int, default=3, help="replays per build; fastest run counts (default 3)")
+    ap.add_argument("--engine", choices=("jieba", "mmap"), default="jieba")
+    ap.add_argument("--userdict", type=Path, default=USERDICT,
+                    help="user dictionary applied before replaying (default ~/.config/paw/userdict.txt)")
+    ap.add_argument("--show", type=int, default=5, help="mismatches to print per build")
+    ap.add_argument("--json", type=Path, help="also write the report as JSON")
+    args = ap.parse_args()
+
+    records = read_trace(args.trace)
+    if not records:
+        sys.exit("trace is empty")
+    builds = args.segmenter or [REPO_DIR / "paw_segmenter.py"]
+    modes = sorted({r["mode"] for r in records})
+    print(f"{len(records)} requests, modes {', '.join(modes)}, "
+          f"{sum(bool(r.get('redacted')) for r in records)} redacted")
+
+    report = {"recorded": summarize(records, [r["ms"] for r in records]), "builds": {}}
+    reference = None
+    failed = False
+    for build in builds:
+        latencies, results = replay(build, records, max(1, args.repeat), args.engine, args.userdict)
+        summary = summarize(records, latencies)
+
+        mismatches = []
+        checked = skipped = 0
+        for i, (r, result) in enumerate(zip(records, results)):
+            if result is None:
+                skipped += 1
+                continue
+            same = matches(r, result)
+            if same is not None:
+                checked += 1
+            if same is False:
+                mismatches.append((i, "trace", r.get("result", r.get("result_crc32")), result))
+            elif reference is not None and reference[1][i] is not None and result != reference[1][i]:
+                mismatches.append((i, builds[0].name, reference[1][i], result))
+        report["builds"][str(build)] = {"latency": summary, "checked": checked,
+                                        "mismatches": len(mismatches), "skipped": skipped}
+
+        print(f"\n{build}")
+        print(f"  {'action':<14}{'count':>7}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}"
+              f"{'recorded p50':>14}{'vs':>8}")
+        for action, s in sorted(summary.items()):
+            recorded = report["recorded"][action]["p50_ms"]
+            vs = ""
+            # 跳过了部分请求时总耗时不可比
+            if reference is not None and reference[0].get(action, {}).get("count") == s["count"]:
+                vs = f"{s['total_ms'] / reference[0][action]['total_ms']:.2f}x"
+            print(f"  {action:<14}{s['count']:>7}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}"
+                  f"{s['p99_ms']:>10.3f}{recorded:>14.3f}{vs:>8}")
+        print(f"  results: {checked} checked against the trace, {len(mismatches)} mismatched"
+              + (f", {skipped} skipped (mode or action not supported by this build)" if skipped else ""))
+        for i, against, expected, got in mismatches[:args.show]:
+            r = records[i]
+            print(f"    #{i} {r['action']} pos {r['pos']} ({r['mode']}, {len(r['text'])} chars): "
+                  f"{against} {str(expected)[:60]!r}, got {got[:60]!r}")
+        failed = failed or bool(mismatches)
+        if reference is None:
+            reference = (summary, results)
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=1, sort_keys=True) + "\n")
+        print(f"\nreport written to {args.json}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
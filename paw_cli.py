@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Paw CLI - Terminal Text Enhancement Manager
-Usage: paw [status|diagnose|daemon start|stop|restart]
+Usage: paw [status|diagnose|bench|daemon start|stop|restart]
 """
 
 import os
@@ -31,6 +31,9 @@ TABBY_PLUGINS = HOME / "Library" / "Application Support" / "tabby" / "plugins"
 TABBY_PAW_PLUGIN = TABBY_PLUGINS / "node_modules" / "tabby-paw"
 TMUX_CONF = HOME / ".tmux.conf"
 TMUX_PASTE_SCRIPT = CONFIG_DIR / "paw-tmux-paste.sh"
+# 按键路径延迟探测：p99 超过该值（ms）时提示
+LATENCY_THRESHOLD_MS = 20
+PROBE_TEXT = "git commit -m 修复中英混排时光标跳转的问题 && git push origin main"
 # Source repo (where this script lives)
 REPO_DIR = Path(__file__).resolve().parent
 
@@ -68,7 +71,10 @@ def detect_env():
     env["has_iterm2"] = Path("/Applications/iTerm.app").is_dir()
     env["has_tabby"] = Path("/Applications/Tabby.app").is_dir()
     env["has_tmux"] = shutil.which("tmux") is not None
-    env["has_nc"] = shutil.which("nc") is not None
+    env["has_zsocket"] = False
+    if shutil.which("zsh"):
+        r = subprocess.run(["zsh", "-c", "zmodload zsh/net/socket"], capture_output=True, timeout=5)
+        env["has_zsocket"] = r.returncode == 0
     env["has_pngpaste"] = shutil.which("pngpaste") is not None
     return env
 
@@ -115,16 +121,151 @@ def _daemon_pid():
 
 def _daemon_responsive():
     try:
-        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        s.settimeout(2)
-        s.connect(str(SOCK_FILE))
-        s.sendall(b"hello\t0\tnext_word\n")
-        r = s.recv(1024).decode().strip()
-        s.close()
-        return r.isdigit()
+        return _query_daemon("", 0, "ping") == "pong"
     except Exception:
         return False
 
+def _query_daemon(text, pos, action, timeout=2):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(str(SOCK_FILE))
+        s.sendall(f"{text}\t{pos}\t{action}\n".encode())
+        return s.makefile(encoding="utf-8").readline().strip()
+    finally:
+        s.close()
+
+def daemon_stats():
+    import json
+    try:
+        st = json.loads(_query_daemon("", 0, "stats"))
+    except Exception as e:
+        print(f"  {fail(f'cannot read stats: {e}')}")
+        return
+    lat = st["latency_ms"]
+    avg = lat["sum"] / lat["count"] if lat["count"] else 0
+    rss = f"{st['rss_kb'] / 1024:.1f} MB" if st.get("rss_kb") else "?"
+    cache = st["cache"]
+    rate = lambda r: "-" if r is None else f"{r:.0%}"
+    print(f"  {'pid':<14}{st['pid']}")
+    if st.get("workers"):
+        print(f"  {'workers':<14}{' '.join(map(str, st['workers']))}  (totals below)")
+    print(f"  {'mode':<14}{st['mode']} (jieba {st['jieba']})")
+    print(f"  {'uptime':<14}{st['uptime_s']:.0f}s")
+    print(f"  {'rss':<14}{rss}")
+    reqs = ", ".join(f"{a} {n}" for a, n in sorted(st["requests"].items())) or "none"
+    print(f"  {'requests':<14}{reqs}  (errors {st['errors']})")
+    print(f"  {'latency':<14}avg {avg:.3f} ms over {lat['count']} requests")
+    print(f"  {'cache':<14}text {rate(cache['hit_rate'])} hit, clause {rate(cache['clause_hit_rate'])} hit")
+
+def _v2_connect(timeout=2):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(str(SOCK_FILE))
+        reader = s.makefile("rb")
+        s.sendall(b"PAW v2\n")
+        ack = reader.readline()
+        if ack != b"OK v2\n":
+            raise RuntimeError(ack.decode(errors="replace").strip() or "no reply to the v2 handshake")
+    except BaseException:
+        s.close()
+        raise
+    return s, reader
+
+def _probe_once(s, reader, text):
+    """发一个 boundaries 帧（与 zsh widget 相同），返回应答里的分词模式"""
+    body = text.encode()
+    s.sendall(f"{len(body)}\t0\tboundaries\treport\n".encode() + body)
+    r = reader.readline().decode().rstrip("\n")
+    if not r or r.startswith("error"):
+        raise RuntimeError(r or "connection closed")
+    return r.rpartition("\t")[2]
+
+def latency_probe(samples):
+    """按键路径的端到端延迟（ms，已排序）。"connect + request" 每次新建连接，
+    即断线重连后的第一次按键；"request" 复用一条常驻连接，即平时的按键。
+    每个样本的文本都不同，不会全部命中 daemon 的整行缓存"""
+    import time
+    cold, warm = [], []
+    for i in range(samples):
+        t0 = time.perf_counter()
+        s, reader = _v2_connect()
+        try:
+            _probe_once(s, reader, f"{PROBE_TEXT} {i}")
+        finally:
+            reader.close()
+            s.close()
+        cold.append((time.perf_counter() - t0) * 1000)
+    s, reader = _v2_connect()
+    try:
+        for i in range(samples, 2 * samples):
+            t0 = time.perf_counter()
+            mode = _probe_once(s, reader, f"{PROBE_TEXT} {i}")
+            warm.append((time.perf_counter() - t0) * 1000)
+    finally:
+        reader.close()
+        s.close()
+    return {"connect + request": sorted(cold), "request": sorted(warm)}, mode
+
+def _percentile(samples, q):
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+def print_latency(results, threshold, full=False):
+    """打印各路径的 p50/p99，返回 p99 是否超过 threshold"""
+    slow = False
+    for label, samples in results.items():
+        qs = (0.5, 0.9, 0.99) if full else (0.5, 0.99)
+        line = f"{label}: " + ", ".join(f"p{q * 100:g} {_percentile(samples, q):.2f} ms" for q in qs)
+        if full:
+            line += f", max {samples[-1]:.2f} ms"
+        if _percentile(samples, 0.99) > threshold:
+            slow = True
+            print(f"  {warn(f'{line} (above {threshold:g} ms)')}")
+        else:
+            print(f"  {ok(line)}")
+    return slow
+
+def bench(args):
+    """paw bench [samples] [--threshold ms]：测按键路径延迟，超过阈值时以状态 1 退出"""
+    samples, threshold = 500, LATENCY_THRESHOLD_MS
+    try:
+        if "--threshold" in args:
+            i = args.index("--threshold")
+            threshold = float(args[i + 1])
+            args = args[:i] + args[i + 2:]
+        if args:
+            samples = max(1, int(args[0]))
+    except (IndexError, ValueError):
+        print("Usage: paw bench [samples] [--threshold ms]")
+        sys.exit(2)
+    if not _daemon_responsive():
+        print(f"  {fail('daemon not responsive (paw daemon start)')}")
+        sys.exit(1)
+    try:
+        results, mode = latency_probe(samples)
+    except Exception as e:
+        print(f"  {fail(f'latency probe error: {e}')}")
+        sys.exit(1)
+    print(f"  {bold('Keystroke latency')} {dim(f'({samples} samples per path, {mode} mode)')}")
+    if print_latency(results, threshold, full=True):
+        print(f"  {dim('see paw daemon stats, or paw daemon profile on to find slow requests')}")
+        sys.exit(1)
+
+def daemon_profile(state=""):
+    try:
+        r = _query_daemon(state, 0, "profile")
+    except Exception as e:
+        print(f"  {fail(f'cannot reach daemon: {e}')}")
+        return
+    if r not in ("on", "off"):
+        print(f"  {fail(r)}")
+        return
+    print(f"  {ok(f'profiling {r}')}")
+    if r == "on":
+        print(f"  {dim('slowest requests are saved to ' + str(CONFIG_DIR / 'profiles'))}")
+        print(f"  {dim('inspect with: python3 -m pstats <file>.prof')}")
+
 def _zshrc_has_paw():
     if ZSHRC.exists():
         return "paw.zsh" in ZSHRC.read_text()
@@ -260,22 +401,64 @@ def daemon_start():
         print(f"  {ok(f'daemon already running (pid {pid})')}")
         return
     _cleanup_stale_daemon()
-    subprocess.Popen(
-        [str(VENV_PYTHON), str(SEGMENTER_PATH)],
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-        start_new_session=True,
-    )
-    import time; time.sleep(1)
+    # daemon 在 socket 可连接时往 ready 管道写一行，无需固定 sleep
+    rfd, wfd = os.pipe()
+    try:
+        subprocess.Popen(
+            [str(VENV_PYTHON), str(SEGMENTER_PATH), "--ready-fd", str(wfd)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True, pass_fds=(wfd,),
+        )
+    finally:
+        os.close(wfd)
+    try:
+        ready = _wait_ready(rfd, timeout=10)
+    finally:
+        os.close(rfd)
     pid = _daemon_pid()
-    if pid:
+    if ready and pid:
         print(f"  {ok(f'daemon started (pid {pid})')}")
     else:
         print(f"  {fail('daemon failed to start')}")
 
+def _wait_ready(fd, timeout):
+    """读 daemon 的 ready 管道：收到 "ready" 返回 True，EOF 或超时返回 False"""
+    import select, time
+    deadline = time.monotonic() + timeout
+    data = b""
+    while b"\n" not in data:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            return False
+        chunk = os.read(fd, 64)
+        if not chunk:
+            return False
+        data += chunk
+    return data.startswith(b"ready")
+
+def _wait_exit(pid, timeout=5):
+    """等待进程退出（daemon 退出时会自己清理 socket 和 pid 文件）"""
+    import time
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # 本进程启动的 daemon 退出后是僵尸进程，先回收
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                return True
+        except ChildProcessError:
+            pass
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.01)
+    return False
+
 def daemon_stop():
     pid = _daemon_pid()
     if pid:
         os.kill(pid, signal.SIGTERM)
+        _wait_exit(pid)
         print(f"  {ok(f'daemon stopped (was pid {pid})')}")
     else:
         print(f"  {dim('daemon not running')}")
@@ -283,7 +466,6 @@ def daemon_stop():
 
 def daemon_restart():
     daemon_stop()
-    import time; time.sleep(0.5)
     daemon_start()
 
 def _cleanup_stale_daemon():
@@ -553,15 +735,22 @@ def diagnose(env):
         # Functional test
         if _daemon_responsive():
             try:
-                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                s.settimeout(2)
-                s.connect(str(SOCK_FILE))
-                s.sendall("你好世界\t0\tnext_word\n".encode())
-                r = s.recv(1024).decode().strip()
-                s.close()
+                import time
+                # daemon 启动后 jieba 在后台加载，期间以 fallback 应答，稍等片刻再判断
+                deadline = time.time() + 5
+                while True:
+                    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    s.settimeout(2)
+                    s.connect(str(SOCK_FILE))
+                    s.sendall("你好世界\t0\tnext_word\treport\n".encode())
+                    r, _, mode = s.recv(1024).decode().strip().partition("\t")
+                    s.close()
+                    if mode != "fallback" or time.time() > deadline:
+                        break
+                    time.sleep(0.5)
                 if r == "2":
                     print(f"  {ok('segmentation test passed (jieba mode)')}")
-                elif r == "1":
+                elif mode == "fallback":
                     print(f"  {warn('segmentation test: fallback mode (jieba not loaded in daemon)')}")
                     if _prompt("Fix: restart daemon?"):
                         daemon_restart()
@@ -570,6 +759,13 @@ def diagnose(env):
                     print(f"  {fail(f'segmentation test unexpected: {r}')}")
             except Exception as e:
                 print(f"  {fail(f'segmentation test error: {e}')}")
+            # 按键路径延迟：连接 + 请求 + 应答
+            try:
+                results, mode = latency_probe(50)
+                if print_latency(results, LATENCY_THRESHOLD_MS):
+                    print(f"    {dim(f'slow in {mode} mode; paw bench measures more samples, paw daemon profile on finds the slow requests')}")
+            except Exception as e:
+                print(f"  {fail(f'latency probe error: {e}')}")
         print()
 
     # Image paste
@@ -689,7 +885,8 @@ def print_header(env):
         print(f"  {label:<12}{value}")
 
     tools = []
-    tools.append(ok("nc") if env["has_nc"] else fail("nc (required for word segmentation)"))
+    tools.append(ok("zsh/net/socket") if env["has_zsocket"]
+                 else fail("zsh/net/socket (required for word segmentation)"))
     if env["has_pngpaste"]:
         tools.append(ok("pngpaste"))
     else:
@@ -798,9 +995,11 @@ def main():
     elif args[0] == "diagnose":
         print_header(env)
         diagnose(env)
+    elif args[0] == "bench":
+        bench(args[1:])
     elif args[0] == "daemon":
         if len(args) < 2:
-            print("Usage: paw daemon [start|stop|restart|status]")
+            print("Usage: paw daemon [start|stop|restart|status|stats|profile [on|off]]")
             return
         sub = args[1]
         if sub == "start":
@@ -809,6 +1008,10 @@ def main():
             daemon_stop()
         elif sub == "restart":
             daemon_restart()
+        elif sub == "stats":
+            daemon_stats()
+        elif sub == "profile":
+            daemon_profile(args[2] if len(args) > 2 else "")
         elif sub == "status":
             pid = _daemon_pid()
             if pid:
@@ -819,7 +1022,7 @@ def main():
         else:
             print(f"Unknown daemon command: {sub}")
     else:
-        print(f"Usage: paw [status|diagnose|daemon start|stop|restart]")
+        print(f"Usage: paw [status|diagnose|bench|daemon start|stop|restart]")
 
 if __name__ == "__main__":
     main()
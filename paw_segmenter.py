@@ -3,27 +3,960 @@
 Paw Segmenter Daemon
 Listens on a Unix socket for segmentation requests.
 Protocol: send "text\\tposition\\taction\\n", receive "new_position\\n"
-Actions: next_word, prev_word, delete_word (returns "start,end")
+Actions: next_word, prev_word, delete_word (returns "start,end"); each takes
+         an optional repeat count, e.g. "next_word:3" hops three words
+         from one segmentation,
+         boundaries (returns every word end offset, space-separated;
+         word starts are 0 and the preceding ends),
+         cache_info (returns "hits=.. misses=.. ..."),
+         stats (returns one line of JSON with request counts, latency and
+         buffer-size histograms, cache hit rates, mode, uptime and RSS),
+         profile (text "on" / "off" toggles per-request profiling, empty
+         text queries it; returns "on" or "off"),
+         ping (returns "pong" without segmenting; a liveness check)
+Readiness: started with "--ready-fd N", the daemon writes "ready\n" to fd N
+and closes it once the socket accepts connections (in pre-fork mode, once
+jieba is loaded); EOF without "ready" means it exited, e.g. because
+another instance is already running.
+Pre-fork: with "processes": N in the segmenter config, the parent loads jieba
+once, forks N workers that share the dictionary copy-on-write and accept on
+the same socket, and restarts any worker that dies. Request counters live
+in shared memory, so stats (from any worker) and the metrics socket
+(served by the parent) report totals over all workers; profile and
+SIGUSR2 (to the parent or any worker) switch profiling for all of them.
+Profiling: PAW_PROFILE=1 (or =N) in the environment, SIGUSR2, or the profile
+action enables cProfile per request; the N slowest requests (default 10)
+are kept as .prof files in ~/.config/paw/profiles/.
+Engine: "engine": "mmap" segments with a copy of jieba's prefix dictionary
+compiled once into ~/.config/paw/dict.bin (recompiled when jieba's dict.txt
+changes; "paw_segmenter.py compile-dict" does it by hand) and memory-mapped,
+so processes share its pages and start without building Python dicts. The
+boundaries are identical to the default "jieba" engine. If the dictionary
+cannot be compiled or mapped, or the engine name is unknown, the daemon
+logs it and uses the "jieba" engine.
+Idle shutdown: "idle_policy" "idle" exits after idle_minutes without
+segmentation requests, "memory-pressure" does so only while the system
+reports memory pressure; the socket and pid file are removed and the next
+client simply spawns a new daemon. Default "never".
+User dictionary: ~/.config/paw/userdict.txt in jieba's userdict format
+("word [freq] [tag]" per line) is polled every userdict_poll seconds and
+applied in place; only cached buffers containing a changed word are dropped.
+Tracing: "trace": true records every segmentation request (buffer, cursor,
+action, options, mode, latency, result) as one JSON line to
+~/.config/paw/traces/trace.jsonl (trace-N.jsonl per pre-fork worker),
+rotated at trace_max_kb; each distinct buffer is written once per file and
+referenced by text_id after that. "trace_redact": true replaces the text
+with same-class placeholder characters first. benchmarks/replay.py replays a
+trace against any build of this file.
+Modes: "jieba" (dictionary + HMM new-word discovery), "dict" (dictionary
+only, HMM off; faster) and "fallback" (character classes, no jieba). The
+"mode" setting picks the default (an unknown one is logged and replaced by
+"jieba"); until jieba has loaded every request is answered in fallback mode.
+Options: an optional fourth field "text\\tposition\\taction\\toptions" holds
+         comma-separated flags; "report" appends "\\t<mode>" (the mode
+         actually used) to the response, "mode=<mode>" overrides the mode
+         for this request.
+Keep-alive: send "PAW keepalive\\n" first, receive "OK keepalive\\n", then any
+number of newline-framed requests on the same connection; responses come
+back in order until the client closes.
+Protocol v2: send "PAW v2\\n", receive "OK v2\\n", then any number of frames
+"length\\tposition\\taction[\\toptions]\\n" followed by exactly length bytes
+of UTF-8 text (which may contain tabs and newlines, with no size limit);
+each frame is answered with one response line.
 """
 
 import os
+import re
 import sys
 import socket
+import select
 import signal
 import json
+import heapq
+import mmap
+import struct
+import threading
+import time
+import unicodedata
+from math import log
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from operator import methodcaller
+from zlib import crc32
 
 SOCKET_PATH = os.path.expanduser("~/.config/paw/paw.sock")
+METRICS_SOCKET_PATH = os.path.expanduser("~/.config/paw/paw-metrics.sock")
 PID_FILE = os.path.expanduser("~/.config/paw/paw.pid")
+PROFILE_DIR = os.path.expanduser("~/.config/paw/profiles")
+USERDICT_FILE = os.path.expanduser("~/.config/paw/userdict.txt")
+DICT_FILE = os.path.expanduser("~/.config/paw/dict.bin")
+CONFIG_FILE = os.path.expanduser("~/.config/paw/config.json")
+TRACE_DIR = os.path.expanduser("~/.config/paw/traces")
+
+DEFAULT_CONFIG = {
+    "segmenter": {
+        "cache_size": 256,
+        "cache_max_chars": 1 << 20,
+        "clause_cache_size": 4096,
+        "lazy_threshold": 4096,
+        "backlog": 128,
+        "max_connections": 128,
+        "read_timeout": 2.0,
+        "keepalive_timeout": 300.0,
+        "segment_threads": 2,
+        "metrics_socket": False,
+        "profile_keep": 10,
+        "processes": 0,
+        "userdict_poll": 2.0,
+        "idle_policy": "never",
+        "idle_minutes": 30,
+        "engine": "jieba",
+        "mode": "jieba",
+        "trace": False,
+        "trace_redact": False,
+        "trace_max_kb": 4096,
+    },
+}
+
+def load_config():
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE) as f:
+                user = json.load(f)
+            for k, v in user.items():
+                if k in config and isinstance(config[k], dict) and isinstance(v, dict):
+                    config[k].update(v)
+                else:
+                    config[k] = v
+        except Exception as e:
+            print(f"Config load error: {e}")
+    return config
+
+ENGINES = ("jieba", "mmap")
 
 def init_jieba():
+    """加载配置的引擎；引擎名未知或 mmap 词典不可用时记一条日志，改用 jieba 自带词典"""
     try:
         import jieba
-        jieba.initialize()
-        return jieba
     except ImportError:
         return None
+    engine = _settings["engine"]
+    if engine not in ENGINES:
+        print(f"engine: unknown engine {engine!r} (expected {' or '.join(ENGINES)}), using jieba")
+    elif engine == "mmap":
+        try:
+            return load_mmap_engine(jieba)
+        except Exception as e:
+            print(f"engine: mmap dictionary unavailable ({e}), using jieba")
+    # stats 报告实际使用的引擎
+    _settings["engine"] = "jieba"
+    jieba.initialize()
+    return jieba
+
+class MmapDict:
+    """jieba 前缀词典（词 → 词频，词的各个前缀词频为 0）的只读磁盘格式。
+    mmap 只读映射，多个进程共享同一份页缓存，打开时无需构建 Python 对象。
+    布局（小端）：
+      header  8s magic, I 槽位数（2 的幂）, Q 总词频, Q 源文件大小, Q 源文件 mtime_ns
+      slots   槽位数 × (I 词条偏移, I 词频)，偏移为 0 表示空槽
+      pool    词条：H UTF-8 字节数 + UTF-8 字节
+    按 crc32(UTF-8) 开放寻址、线性探测。
+    """
+    MAGIC = b"PAWDICT1"
+    HEADER = struct.Struct("<8sIQQQ")
+    SLOT = struct.Struct("<II")
+    KEYLEN = struct.Struct("<H")
+
+    def __init__(self, mm):
+        magic, nslots, self.total, self.source_size, self.source_mtime_ns = \
+            self.HEADER.unpack_from(mm, 0)
+        if magic != self.MAGIC:
+            raise ValueError("not a paw dictionary")
+        self._mm = mm
+        self._mask = nslots - 1
+
+    @classmethod
+    def open(cls, path):
+        """打开已编译的词典，文件不存在或格式不对时返回 None"""
+        try:
+            with open(path, "rb") as f:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError, struct.error):
+            return None
+
+    @classmethod
+    def compile(cls, freq, total, path, source_size=0, source_mtime_ns=0):
+        """把 {词: 词频} 写成磁盘格式；先写临时文件再改名，并发编译互不干扰"""
+        nslots = 1
+        while nslots < len(freq) * 3 // 2:
+            nslots *= 2
+        mask = nslots - 1
+        slots = array("I", bytes(8 * nslots))
+        pool = bytearray()
+        base = cls.HEADER.size + 8 * nslots
+        for word, n in freq.items():
+            key = word.encode("utf-8")
+            i = crc32(key) & mask
+            while slots[2 * i]:
+                i = (i + 1) & mask
+            slots[2 * i] = base + len(pool)
+            slots[2 * i + 1] = n
+            pool += cls.KEYLEN.pack(len(key)) + key
+        if sys.byteorder != "little":
+            slots.byteswap()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, nslots, total, source_size, source_mtime_ns))
+                f.write(slots.tobytes())
+                f.write(pool)
+            os.replace(tmp, path)
+        except BaseException:
+            try: os.unlink(tmp)
+            except: pass
+            raise
+
+    def get(self, word, default=None):
+        key = word.encode("utf-8")
+        mm, mask = self._mm, self._mask
+        i = crc32(key) & mask
+        while True:
+            off, freq = self.SLOT.unpack_from(mm, self.HEADER.size + 8 * i)
+            if not off:
+                return default
+            n = self.KEYLEN.unpack_from(mm, off)[0]
+            if n == len(key) and mm[off + 2:off + 2 + n] == key:
+                return freq
+            i = (i + 1) & mask
+
+_MISSING = object()
+
+class _OverlayFreq:
+    """mmap 词典之上的可写覆盖层（用户词典的改动），接口同 jieba 的 FREQ 字典"""
+
+    def __init__(self, base):
+        self.base = base
+        self.overlay = {}
+
+    def get(self, word, default=None):
+        freq = self.overlay.get(word, _MISSING)
+        if freq is _MISSING:
+            return self.base.get(word, default)
+        return freq
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __getitem__(self, word):
+        freq = self.get(word)
+        if freq is None:
+            raise KeyError(word)
+        return freq
+
+    def __setitem__(self, word, freq):
+        self.overlay[word] = freq
+
+class MmapEngine:
+    """基于 MmapDict 的分词引擎，逐步照搬 jieba.Tokenizer 的 get_DAG / calc /
+    __cut_DAG / cut（HMM 仍用 jieba.finalseg），结果与 jieba.cut 完全一致。
+    提供 _clause_groups 与 UserDict 用到的那部分 jieba 接口。
+    """
+
+    def __init__(self, jieba, mdict):
+        self.dt = self
+        self.finalseg = jieba.finalseg
+        self.FREQ = _OverlayFreq(mdict)
+        self.total = mdict.total
+        self.user_word_tag_tab = {}
+        self._re_han = jieba.re_han_default
+        self._re_skip = jieba.re_skip_default
+        self._re_eng = jieba.re_eng
+
+    def _dag(self, sentence):
+        """get_DAG，顺带记下每条边的词频供 calc 使用，省去第二次查表"""
+        lookup = self.FREQ.get
+        n = len(sentence)
+        dag = []
+        for k in range(n):
+            edges = []
+            i = k
+            freq = lookup(sentence[k])
+            while freq is not None:
+                if freq:
+                    edges.append((i, freq))
+                i += 1
+                if i >= n:
+                    break
+                freq = lookup(sentence[k:i + 1])
+            dag.append(edges or [(k, 1)])
+        return dag
+
+    def _route(self, sentence):
+        """calc：与 jieba 相同的浮点运算顺序，保证并列时选择一致"""
+        dag = self._dag(sentence)
+        n = len(sentence)
+        route = [None] * n + [(0, 0)]
+        logtotal = log(self.total)
+        for idx in range(n - 1, -1, -1):
+            route[idx] = max((log(freq) - logtotal + route[x + 1][0], x) for x, freq in dag[idx])
+        return route
+
+    def _cut_dag(self, sentence):
+        route = self._route(sentence)
+        x = 0
+        buf = ""
+        n = len(sentence)
+        while x < n:
+            y = route[x][1] + 1
+            l_word = sentence[x:y]
+            if y - x == 1:
+                buf += l_word
+            else:
+                if buf:
+                    yield from self._flush(buf)
+                    buf = ""
+                yield l_word
+            x = y
+        if buf:
+            yield from self._flush(buf)
+
+    def _flush(self, buf):
+        if len(buf) == 1:
+            yield buf
+        elif not self.FREQ.get(buf):
+            yield from self.finalseg.cut(buf)
+        else:
+            yield from buf
+
+    def _cut_dag_no_hmm(self, sentence):
+        route = self._route(sentence)
+        x = 0
+        n = len(sentence)
+        buf = ""
+        while x < n:
+            y = route[x][1] + 1
+            l_word = sentence[x:y]
+            if self._re_eng.match(l_word) and len(l_word) == 1:
+                buf += l_word
+            else:
+                if buf:
+                    yield buf
+                    buf = ""
+                yield l_word
+            x = y
+        if buf:
+            yield buf
+
+    def cut(self, sentence, HMM=True):
+        cut_block = self._cut_dag if HMM else self._cut_dag_no_hmm
+        for blk in self._re_han.split(sentence):
+            if not blk:
+                continue
+            if self._re_han.match(blk):
+                yield from cut_block(blk)
+            else:
+                for x in self._re_skip.split(blk):
+                    if self._re_skip.match(x):
+                        yield x
+                    else:
+                        yield from x
+
+    def suggest_freq(self, word):
+        freq = 1
+        ftotal = float(self.total)
+        for seg in self.cut(word, HMM=False):
+            freq *= self.FREQ.get(seg, 1) / ftotal
+        return max(int(freq * self.total) + 1, self.FREQ.get(word, 1))
+
+    def add_word(self, word, freq=None, tag=None):
+        """同 jieba.add_word，改动只写进覆盖层"""
+        freq = int(freq) if freq is not None else self.suggest_freq(word)
+        self.FREQ[word] = freq
+        self.total += freq
+        if tag:
+            self.user_word_tag_tab[word] = tag
+        for ch in range(len(word)):
+            wfrag = word[:ch + 1]
+            if wfrag not in self.FREQ:
+                self.FREQ[wfrag] = 0
+        if freq == 0:
+            self.finalseg.add_force_split(word)
+
+def _jieba_dict_source(jieba):
+    return os.path.join(os.path.dirname(jieba.__file__), jieba.DEFAULT_DICT_NAME)
+
+def compile_dict(jieba, path=DICT_FILE):
+    """用 jieba 自己的 gen_pfdict 解析 dict.txt，保证词频与总词频和 jieba 完全相同"""
+    source = _jieba_dict_source(jieba)
+    st = os.stat(source)
+    with open(source, "rb") as f:
+        freq, total = jieba.Tokenizer.gen_pfdict(f)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    MmapDict.compile(freq, total, path, st.st_size, st.st_mtime_ns)
+
+def load_mmap_engine(jieba, path=DICT_FILE):
+    """打开 dict.bin，缺失或与 jieba 的 dict.txt 不一致时先编译"""
+    st = os.stat(_jieba_dict_source(jieba))
+    mdict = MmapDict.open(path)
+    if mdict is None or (mdict.source_size, mdict.source_mtime_ns) != (st.st_size, st.st_mtime_ns):
+        # 在子进程里编译，构建 Python 词典的内存峰值不会留在 daemon 里
+        import subprocess
+        subprocess.run([sys.executable, os.path.abspath(__file__), "compile-dict", path],
+                       check=True, stdout=subprocess.DEVNULL)
+        mdict = MmapDict.open(path)
+        if mdict is None:
+            raise RuntimeError(f"cannot open {path} after compiling it")
+    return MmapEngine(jieba, mdict)
 
 _jieba = None
+# jieba 在后台线程加载："loading" → "loaded" / "unavailable"
+_jieba_state = "loading"
+
+class BoundaryCache:
+    """按文本缓存分词边界的 LRU。
+    条目数超过 maxsize 或缓存文本总字符数超过 max_chars 时，淘汰最久未用的条目。
+    maxsize 为 0 时不缓存。
+    """
+
+    def __init__(self, maxsize=256, max_chars=1 << 20):
+        self.maxsize = maxsize
+        self.max_chars = max_chars
+        self._data = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text):
+        with self._lock:
+            bounds = self._data.get(text)
+            if bounds is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(text)
+            self.hits += 1
+            return bounds
+
+    def peek(self, text):
+        """查询但不计入命中率、不调整顺序"""
+        return self._data.get(text)
+
+    def put(self, text, bounds):
+        if self.maxsize <= 0 or len(text) > self.max_chars:
+            return
+        with self._lock:
+            old = self._data.pop(text, None)
+            if old is not None:
+                self._chars -= len(text)
+            self._data[text] = bounds
+            self._chars += len(text)
+            while len(self._data) > self.maxsize or self._chars > self.max_chars:
+                evicted, _ = self._data.popitem(last=False)
+                self._chars -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._chars = 0
+
+    def discard_if(self, predicate):
+        """删除 predicate(text) 为真的条目，返回删除数"""
+        with self._lock:
+            doomed = [text for text in self._data if predicate(text)]
+            for text in doomed:
+                del self._data[text]
+                self._chars -= len(text)
+        return len(doomed)
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "chars": self._chars,
+            }
+
+class Metrics:
+    """请求计数、延迟与缓冲区大小直方图（累计桶，与 Prometheus 一致）。
+    计数放在匿名共享内存里，每个进程写自己的一格，读出的是所有格的合计：
+    pre-fork 模式下任何进程（包括只做监督的父进程）看到的都是全部 worker 的总数，
+    worker 重启后接着原来那一格累加，计数不会倒退。"""
+    LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+    SIZE_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+    ACTIONS = ("next_word", "prev_word", "delete_word", "boundaries", "cache_info", "stats",
+               "profile", "ping")
+    CACHE_FIELDS = ("hits", "misses", "evictions", "size", "chars")
+    # 缓存字段里前几项是累计值，换 worker 后接在旧值上；size/chars 是当前值
+    _CACHE_COUNTERS = 3
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._index = {a: i for i, a in enumerate(self.ACTIONS)}
+        # 每格依次为：pid、错误数、延迟总和（µs）、缓冲区字符总数、各动作请求数（含 other）、
+        # 延迟桶、大小桶、文本缓存与子句缓存的 CACHE_FIELDS
+        self._req = 4
+        self._lat = self._req + len(self.ACTIONS) + 1
+        self._size = self._lat + len(self.LATENCY_BUCKETS_MS) + 1
+        self._cache = self._size + len(self.SIZE_BUCKETS) + 1
+        self._width = self._cache + 2 * len(self.CACHE_FIELDS)
+        self.share(1)
+        self.use_slot(0)
+
+    def share(self, slots):
+        """重新分配 slots 格计数，此后本进程不占格；pre-fork 模式在 fork 之前调用"""
+        self.slots = slots
+        self._buf = mmap.mmap(-1, 8 * self._width * slots)
+        self._cells = memoryview(self._buf).cast("q")
+        self._base = None
+
+    def use_slot(self, slot):
+        """认领第 slot 格（worker 启动时）；缓存计数接在上一个 worker 留下的值上"""
+        base = slot * self._width
+        self._cells[base] = os.getpid()
+        n = len(self.CACHE_FIELDS)
+        cache = self._cells[base + self._cache:base + self._width].tolist()
+        self._cache_base = [v if i % n < self._CACHE_COUNTERS else 0 for i, v in enumerate(cache)]
+        self._base = base
+
+    @staticmethod
+    def _bucket(bounds, value):
+        return bisect_left(bounds, value)
+
+    def record(self, action, size, ms, error=False):
+        base, cells = self._base, self._cells
+        if base is None:
+            return
+        with self._lock:
+            cells[base + self._req + self._index.get(action, len(self.ACTIONS))] += 1
+            cells[base + 1] += error
+            cells[base + 2] += round(ms * 1000)
+            cells[base + 3] += size
+            cells[base + self._lat + self._bucket(self.LATENCY_BUCKETS_MS, ms)] += 1
+            cells[base + self._size + self._bucket(self.SIZE_BUCKETS, size)] += 1
+
+    def publish_cache(self, info):
+        """把本进程 cache_info() 的结果写进自己那一格"""
+        if self._base is None:
+            return
+        keys = [prefix + f for prefix in ("", "clause_") for f in self.CACHE_FIELDS]
+        with self._lock:
+            for i, key in enumerate(keys):
+                self._cells[self._base + self._cache + i] = self._cache_base[i] + info[key]
+
+    @staticmethod
+    def _cumulative(bounds, counts):
+        out, total = {}, 0
+        for bound, n in zip(list(bounds) + ["+Inf"], counts):
+            total += n
+            out[str(bound)] = total
+        return out
+
+    def snapshot(self):
+        w = self._width
+        totals = [sum(self._cells[k::w]) for k in range(w)]
+        latency = totals[self._lat:self._size]
+        sizes = totals[self._size:self._cache]
+        requests = dict(zip(self.ACTIONS + ("other",), totals[self._req:self._lat]))
+        keys = [prefix + f for prefix in ("", "clause_") for f in self.CACHE_FIELDS]
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "pids": [p for p in self._cells[::w] if p],
+            "requests": {a: n for a, n in requests.items() if n},
+            "errors": totals[1],
+            "latency_ms": {
+                "buckets": self._cumulative(self.LATENCY_BUCKETS_MS, latency),
+                "sum": round(totals[2] / 1000, 3),
+                "count": sum(latency),
+            },
+            "buffer_chars": {
+                "buckets": self._cumulative(self.SIZE_BUCKETS, sizes),
+                "sum": totals[3],
+                "count": sum(sizes),
+            },
+            "cache": dict(zip(keys, totals[self._cache:])),
+        }
+
+_metrics = Metrics()
+
+class Activity:
+    """最近一次请求的时间（time.monotonic）。放在匿名共享内存里，
+    pre-fork 模式下各 worker 写入，父进程读取。"""
+
+    def __init__(self):
+        self._buf = mmap.mmap(-1, 8)
+        self.touch()
+
+    def touch(self):
+        struct.pack_into("d", self._buf, 0, time.monotonic())
+
+    def idle_seconds(self):
+        return time.monotonic() - struct.unpack_from("d", self._buf, 0)[0]
+
+_activity = Activity()
+
+def _rss_kb(pid=None):
+    """进程的常驻内存（KB，默认当前进程）；Linux 读 /proc，macOS 调 ps"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        pass
+    try:
+        import subprocess
+        r = subprocess.run(["ps", "-o", "rss=", "-p", str(pid or os.getpid())],
+                           capture_output=True, text=True, timeout=2)
+        return int(r.stdout.strip())
+    except Exception:
+        return None
+
+def stats():
+    """daemon 的合计指标；pre-fork 模式下是所有 worker 的总和，内存含父进程"""
+    _metrics.publish_cache(cache_info())
+    snap = _metrics.snapshot()
+    pids = snap.pop("pids")
+    if int(_settings["processes"]) > 0:
+        snap["workers"] = pids
+    rss = [r for r in map(_rss_kb, {_owner_pid, *pids}) if r is not None]
+    cache = snap["cache"]
+    for prefix, size_key in (("", "cache_size"), ("clause_", "clause_cache_size")):
+        cache[f"{prefix}maxsize"] = int(_settings[size_key]) * max(1, len(pids))
+        lookups = cache[f"{prefix}hits"] + cache[f"{prefix}misses"]
+        cache[f"{prefix}hit_rate"] = round(cache[f"{prefix}hits"] / lookups, 4) if lookups else None
+    snap.update({
+        "pid": _owner_pid,
+        "mode": serving_mode(),
+        "jieba": _jieba_state,
+        "rss_kb": sum(rss) if rss else None,
+        "userdict_words": len(_userdict.words),
+        "idle_s": round(_activity.idle_seconds(), 1),
+        "engine": _settings["engine"],
+        "cache": cache,
+    })
+    return snap
+
+def prometheus_metrics():
+    """Prometheus 文本格式的指标"""
+    st = stats()
+    lines = [
+        "# TYPE paw_uptime_seconds gauge",
+        f"paw_uptime_seconds {st['uptime_s']}",
+        "# TYPE paw_jieba_loaded gauge",
+        f"paw_jieba_loaded {int(st['jieba'] == 'loaded')}",
+        "# TYPE paw_requests_total counter",
+    ]
+    lines += [f'paw_requests_total{{action="{a}"}} {n}' for a, n in sorted(st["requests"].items())]
+    lines += ["# TYPE paw_errors_total counter", f"paw_errors_total {st['errors']}"]
+    lines.append("# TYPE paw_request_duration_ms histogram")
+    for le, n in st["latency_ms"]["buckets"].items():
+        lines.append(f'paw_request_duration_ms_bucket{{le="{le}"}} {n}')
+    lines += [
+        f"paw_request_duration_ms_sum {st['latency_ms']['sum']}",
+        f"paw_request_duration_ms_count {st['latency_ms']['count']}",
+        "# TYPE paw_buffer_chars histogram",
+    ]
+    for le, n in st["buffer_chars"]["buckets"].items():
+        lines.append(f'paw_buffer_chars_bucket{{le="{le}"}} {n}')
+    lines.append(f"paw_buffer_chars_sum {st['buffer_chars']['sum']}")
+    lines.append(f"paw_buffer_chars_count {st['buffer_chars']['count']}")
+    lines.append("# TYPE paw_cache_hits_total counter")
+    lines.append(f'paw_cache_hits_total{{cache="text"}} {st["cache"]["hits"]}')
+    lines.append(f'paw_cache_hits_total{{cache="clause"}} {st["cache"]["clause_hits"]}')
+    lines.append("# TYPE paw_cache_misses_total counter")
+    lines.append(f'paw_cache_misses_total{{cache="text"}} {st["cache"]["misses"]}')
+    lines.append(f'paw_cache_misses_total{{cache="clause"}} {st["cache"]["clause_misses"]}')
+    if st["rss_kb"] is not None:
+        lines += ["# TYPE paw_resident_memory_bytes gauge",
+                  f"paw_resident_memory_bytes {st['rss_kb'] * 1024}"]
+    return "\n".join(lines) + "\n"
+
+class Profiler:
+    """逐请求 cProfile，只保留最慢的 keep 个请求的 .prof 文件"""
+
+    def __init__(self, keep=10, directory=PROFILE_DIR):
+        self.keep = max(1, keep)
+        self.directory = directory
+        self._slowest = []  # (ms, path) 小顶堆
+        self._seq = 0
+        # cProfile 同一时刻只能有一个在运行，开启 profiling 时请求串行执行
+        self._lock = threading.Lock()
+
+    def run(self, fn, text, pos, action, options):
+        import cProfile
+        with self._lock:
+            prof = cProfile.Profile()
+            t0 = time.perf_counter()
+            try:
+                return prof.runcall(fn, text, pos, action, options)
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                self._keep_if_slow(prof, ms, action, len(text))
+
+    def _keep_if_slow(self, prof, ms, action, size):
+        if len(self._slowest) >= self.keep and ms <= self._slowest[0][0]:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._seq += 1
+        name = f"{ms:09.3f}ms-{action}-{size}c-{os.getpid()}-{self._seq}.prof"
+        path = os.path.join(self.directory, name)
+        prof.dump_stats(path)
+        heapq.heappush(self._slowest, (ms, path))
+        if len(self._slowest) > self.keep:
+            _, dropped = heapq.heappop(self._slowest)
+            try: os.unlink(dropped)
+            except OSError: pass
+
+class ProfileSwitch:
+    """profiling 开关与保留个数，放在匿名共享内存里：pre-fork 模式下无论在哪个
+    进程打开或关闭（profile 动作、发给父进程或 worker 的 SIGUSR2），
+    所有 worker 都在各自的下一个请求时跟上"""
+
+    def __init__(self):
+        self._buf = mmap.mmap(-1, 16)
+        self._cells = memoryview(self._buf).cast("q")
+
+    def set(self, on, keep):
+        self._cells[1] = keep
+        self._cells[0] = int(on)
+
+    def get(self):
+        return bool(self._cells[0]), self._cells[1]
+
+    def on(self):
+        return self._cells[0] != 0
+
+_profile_switch = ProfileSwitch()
+_profiler = None
+
+def _sync_profiling():
+    """按共享开关创建或丢弃本进程的 Profiler"""
+    global _profiler
+    on, keep = _profile_switch.get()
+    if on and _profiler is None:
+        _profiler = Profiler(keep)
+    elif not on:
+        _profiler = None
+    return on
+
+def set_profiling(enabled, keep=None):
+    _profile_switch.set(enabled, keep or int(_settings["profile_keep"]))
+    return _sync_profiling()
+
+def _toggle_profiling(*_):
+    set_profiling(not _profile_switch.on())
+
+class Tracer:
+    """把分词请求逐条写成 JSON 行，文件到 max_bytes 后滚动，保留 BACKUPS 份旧文件。
+    同一个缓冲区在每个文件里只写一次全文（带 text_id），之后的记录只写 text_id，
+    在长文本里移动光标不会每次都写一整份缓冲区；文件滚动后重新开始，每个文件自成一体"""
+    BACKUPS = 3
+    ACTIONS = ("next_word", "prev_word", "delete_word", "boundaries")
+    # 超过该长度的结果只记 crc32，trace 不会被大段 boundaries 撑大
+    RESULT_MAX = 256
+
+    def __init__(self, path, max_bytes, redact=False):
+        import logging
+        import logging.handlers
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.redact = redact
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=self.BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._handler = handler
+        self._lock = threading.Lock()
+        self._written = set()
+        rollover = handler.doRollover
+        def do_rollover():
+            rollover()
+            self._written.clear()
+        handler.doRollover = do_rollover
+        self._log = logging.getLogger(f"paw.trace.{path}")
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+        self._log.addHandler(handler)
+
+    def record(self, text, pos, action, options, mode, ms, result):
+        entry = {"t": round(time.time(), 3), "pos": pos, "action": action, "mode": mode,
+                 "ms": round(ms, 4)}
+        if options:
+            entry["options"] = options
+        if self.redact:
+            text = text.translate(_REDACTED)
+            entry["redacted"] = True
+        entry["text_id"] = text_id = f"{crc32(text.encode('utf-8')):08x}-{len(text)}"
+        # 脱敏只保留字符类别，fallback 模式下的结果与原文一致，其他模式的结果没有意义
+        if not self.redact or mode == "fallback":
+            if len(result) <= self.RESULT_MAX:
+                entry["result"] = result
+            else:
+                entry["result_crc32"] = crc32(result.encode("utf-8"))
+        import logging
+        with self._lock:
+            if text_id not in self._written:
+                entry["text"] = text
+            line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+            # 这一条会落进滚动后的新文件时，要带上全文
+            if "text" not in entry and self._handler.shouldRollover(logging.makeLogRecord({"msg": line})):
+                self._handler.doRollover()
+                entry["text"] = text
+                line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+            self._log.info(line)
+            self._written.add(text_id)
+
+_tracer = None
+
+def _start_tracer(slot=None):
+    global _tracer
+    if _settings["trace"]:
+        name = "trace.jsonl" if slot is None else f"trace-{slot}.jsonl"
+        _tracer = Tracer(os.path.join(TRACE_DIR, name), int(_settings["trace_max_kb"]) * 1024,
+                         bool(_settings["trace_redact"]))
+
+_settings = dict(DEFAULT_CONFIG["segmenter"])
+# 每种分词模式（jieba / dict / fallback）各一份文本缓存与子句缓存，结果不会串用
+_caches = {}
+_clause_caches = {}
+# 同时进行分词计算的线程数上限（jieba 是 CPU 密集型）；只在缓存未命中、
+# 真正分词时占用（word_index 与惰性分词），命中缓存和状态查询不受限
+_segment_slots = threading.BoundedSemaphore(_settings["segment_threads"])
+
+def _mode_cache(caches, mode, size_key):
+    cache = caches.get(mode)
+    if cache is None:
+        cache = caches.setdefault(mode, BoundaryCache(
+            maxsize=int(_settings[size_key]),
+            max_chars=int(_settings["cache_max_chars"]),
+        ))
+    return cache
+
+def _text_cache(mode):
+    return _mode_cache(_caches, mode, "cache_size")
+
+def _clause_cache(mode):
+    return _mode_cache(_clause_caches, mode, "clause_cache_size")
+
+def configure(config):
+    global _segment_slots
+    _settings.update(config.get("segmenter", {}))
+    if _settings["mode"] not in MODES:
+        print(f"mode: unknown mode {_settings['mode']!r} (expected {', '.join(MODES)}), using jieba")
+        _settings["mode"] = "jieba"
+    _caches.clear()
+    _clause_caches.clear()
+    _segment_slots = threading.BoundedSemaphore(max(1, int(_settings["segment_threads"])))
+
+def clear_caches():
+    for cache in list(_caches.values()) + list(_clause_caches.values()):
+        cache.clear()
+
+def cache_info():
+    info = {}
+    for prefix, caches, size_key in (("", _caches, "cache_size"),
+                                     ("clause_", _clause_caches, "clause_cache_size")):
+        total = {"hits": 0, "misses": 0, "evictions": 0, "size": 0,
+                 "maxsize": int(_settings[size_key]), "chars": 0}
+        for cache in list(caches.values()):
+            for k, v in cache.info().items():
+                if k != "maxsize":
+                    total[k] += v
+        info.update((prefix + k, v) for k, v in total.items())
+    return info
+
+# jieba 用户词典的行格式：词 [词频] [词性]
+_USERDICT_LINE_RE = re.compile(r"^(.+?)( [0-9]+)?( [a-z]+)?$")
+
+def _read_userdict(path):
+    """解析用户词典，返回 {词: (词频或 None, 词性或 None)}；# 开头为注释"""
+    words = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            word, freq, tag = _USERDICT_LINE_RE.match(line).groups()
+            words[word] = (int(freq) if freq else None, tag.strip() if tag else None)
+    return words
+
+class UserDict:
+    """用户词典热加载：文件变化时按差异增删词，只淘汰含变动词的缓存条目。
+    jieba 的总词频保持不变，因此不含变动词的文本分词结果不变，缓存仍然有效。
+    """
+
+    def __init__(self, path=USERDICT_FILE):
+        self.path = path
+        self.words = {}
+        # 词 → 加入用户词典前在 jieba 中的 (词频, 是否强制拆分)，移除时恢复
+        self._original = {}
+        self._stamp = None
+
+    def poll(self, jieba):
+        """文件有变化时应用到 jieba，返回变动的词"""
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._stamp:
+            return set()
+        words = _read_userdict(self.path) if stamp else {}
+        self._stamp = stamp
+        changed = {w for w in words.keys() | self.words.keys() if words.get(w) != self.words.get(w)}
+        if changed:
+            self._apply(jieba, words, changed)
+        return changed
+
+    def _apply(self, jieba, words, changed):
+        # 占满全部分词名额：更新期间没有请求在分词，不会有旧结果在失效之后写回缓存
+        slots, n = _segment_slots, max(1, int(_settings["segment_threads"]))
+        for _ in range(n):
+            slots.acquire()
+        try:
+            for word in changed:
+                if word in words:
+                    self._add(jieba, word, *words[word])
+                else:
+                    self._remove(jieba, word)
+            self.words = words
+            _discard_cached(changed)
+        finally:
+            for _ in range(n):
+                slots.release()
+
+    def _add(self, jieba, word, freq, tag):
+        dt, forced = jieba.dt, jieba.finalseg.Force_Split_Words
+        if word not in self._original:
+            self._original[word] = (dt.FREQ.get(word), word in forced)
+        total = dt.total
+        forced.discard(word)
+        dt.add_word(word, freq, tag)
+        dt.total = total
+
+    def _remove(self, jieba, word):
+        freq, was_forced = self._original.pop(word, (None, False))
+        forced = jieba.finalseg.Force_Split_Words
+        # 留下词频为 0 的键与不存在等价（jieba 同样这样保存词的前缀）
+        jieba.dt.FREQ[word] = freq or 0
+        if was_forced:
+            forced.add(word)
+        else:
+            forced.discard(word)
+
+_userdict = UserDict()
+
+def _discard_cached(words):
+    """删除 jieba 各模式下包含任一 words 的文本缓存与子句缓存条目"""
+    pattern = re.compile("|".join(map(re.escape, sorted(words, key=len, reverse=True))))
+    for mode in _JIEBA_MODES:
+        for cache in (_caches.get(mode), _clause_caches.get(mode)):
+            if cache is not None:
+                cache.discard_if(pattern.search)
 
 def _is_cjk(ch):
     cp = ord(ch)
@@ -45,7 +978,45 @@ def _is_cjk_single(t):
     """单个 CJK 字符（非标点）"""
     return len(t) == 1 and _is_cjk(t[0])
 
-def _merge_jieba_tokens(tokens):
+class _CharTable(dict):
+    """按码点查表的字符分类，未见过的字符首次查询时计算并记住。
+    值为 str 时可直接作为 str.translate 的映射，一次 C 级调用把整段文本转成类别串。
+    """
+    __slots__ = ("classify",)
+
+    def __init__(self, classify):
+        super().__init__()
+        self.classify = classify
+        for cp in range(128):
+            self[cp]
+
+    def __missing__(self, cp):
+        value = self[cp] = self.classify(chr(cp))
+        return value
+
+# token 类别：普通词 / 单个 CJK 字 / 标点空格
+_OTHER, _SINGLE, _BREAK = 0, 1, 2
+
+_TOKEN_KINDS = _CharTable(
+    lambda ch: _BREAK if _is_break_char(ch) else _SINGLE if _is_cjk(ch) else _OTHER
+)
+
+def _token_kind(t):
+    if len(t) == 1:
+        return _TOKEN_KINDS[ord(t)]
+    # 多字 token 只有全是空白时才算分界
+    return _BREAK if t.isspace() else _OTHER
+
+def _token_ends(words):
+    """把 jieba.cut 产出的词序列压成 (词尾偏移 array('I'), 类别 bytearray)，不保留词本身"""
+    ends, kinds, pos = array("I"), bytearray(), 0
+    for w in words:
+        pos += len(w)
+        ends.append(pos)
+        kinds.append(_token_kind(w))
+    return ends, kinds
+
+def _merge_jieba_tokens(words):
     """将 jieba 的碎片单字词合并到相邻多字词，标点/空格处断开。
     规则：
     - 标点/空格处一定断开
@@ -53,128 +1024,757 @@ def _merge_jieba_tokens(tokens):
     - 1~2 个连续单字词吸附到紧跟其后的多字词（前缀吸附）
     - 尾部的单字词吸附到前一个多字词（后缀吸附）
     - 3 个以上连续单字词独立成组
+    返回各组词尾偏移的 array('I')：组首尾相接，第 i 组从第 i-1 组的词尾开始。
     """
-    if not tokens:
-        return []
-
-    # 先按标点/空格切成段，段内再合并
-    segments = []
-    cur_seg = [tokens[0]]
-    for i in range(1, len(tokens)):
-        t = tokens[i][0]
-        prev_t = tokens[i - 1][0]
-        if _is_break_char(t) or _is_break_char(prev_t):
-            segments.append(cur_seg)
-            cur_seg = [tokens[i]]
-        else:
-            cur_seg.append(tokens[i])
-    segments.append(cur_seg)
+    return _merge_token_ends(*_token_ends(words))
 
-    groups = []
-    for seg in segments:
-        if len(seg) == 1:
-            groups.append((seg[0][1], seg[0][2]))
+def _merge_token_ends(ends, kinds):
+    groups = array("I")
+    n = len(ends)
+    i = 0
+    while i < n:
+        # 标点/空格单独成段；其余 token 连续成段，段内再合并
+        if kinds[i] == _BREAK:
+            groups.append(ends[i])
+            i += 1
+            continue
+        seg_end = kinds.find(_BREAK, i)
+        if seg_end < 0:
+            seg_end = n
+        if seg_end - i == 1:
+            groups.append(ends[i])
+            i = seg_end
             continue
-
-        # 段内：先标记每个 token 是否为单字
-        is_single = [_is_cjk_single(t) for t, _, _ in seg]
 
         # 向前看：连续单字 + 后面紧跟的多字词合为一组
-        i = 0
-        while i < len(seg):
-            if not is_single[i]:
+        while i < seg_end:
+            if kinds[i] != _SINGLE:
                 # 多字词，看前面有没有刚积攒的单字要吸附
-                groups.append((seg[i][1], seg[i][2]))
+                groups.append(ends[i])
                 i += 1
             else:
                 # 数连续单字
                 j = i
-                while j < len(seg) and is_single[j]:
+                while j < seg_end and kinds[j] == _SINGLE:
                     j += 1
                 n_singles = j - i
-                if j < len(seg) and n_singles <= 2:
+                if j < seg_end and n_singles <= 2:
                     # 1~2 个单字 + 后面的多字词合并
-                    groups.append((seg[i][1], seg[j][2]))
+                    groups.append(ends[j])
                     i = j + 1
                 elif n_singles <= 2 and groups:
                     # 尾部 1~2 个单字，吸附到前一个组
-                    prev_start, _ = groups[-1]
-                    groups[-1] = (prev_start, seg[j - 1][2])
+                    groups[-1] = ends[j - 1]
                     i = j
                 else:
                     # 3+ 连续单字，独立成组
-                    groups.append((seg[i][1], seg[j - 1][2]))
+                    groups.append(ends[j - 1])
                     i = j
     return groups
 
+def _char_class(ch):
+    if ch.isspace(): return "s"
+    if _is_cjk(ch): return "c"
+    cat = unicodedata.category(ch)
+    if cat[0] in ("P", "S"): return "p"
+    if ch.isalnum(): return "a"
+    return "o"
+
+_CHAR_CLASSES = _CharTable(_char_class)
+
+# trace 脱敏：每个字符换成同类别的代表字符，空白原样保留，长度与偏移不变
+_REDACT_CHARS = {"c": "中", "p": ".", "a": "a", "o": "\u200b"}
+_REDACTED = _CharTable(lambda ch: _REDACT_CHARS.get(_char_class(ch), ch))
+
+# 类别串里的同类字符段
+_RUN_RE = re.compile(r"s+|c+|p+|a+|o+")
+_match_end = methodcaller("end")
+
 def _fallback_boundaries(text):
-    """无 jieba 时按字符类型分组"""
-    import unicodedata
-    if not text:
-        return []
-    def cls(ch):
-        if ch.isspace(): return "s"
-        if _is_cjk(ch): return "c"
-        cat = unicodedata.category(ch)
-        if cat[0] in ("P", "S"): return "p"
-        if ch.isalnum(): return "a"
-        return "o"
-    bounds, start, prev = [], 0, cls(text[0])
-    for i in range(1, len(text)):
-        c = cls(text[i])
-        if c != prev:
-            bounds.append((start, i))
-            start, prev = i, c
-    bounds.append((start, len(text)))
-    return bounds
-
-def get_word_boundaries(text):
-    if not text:
-        return []
-    if _jieba:
-        tokens = [(t, s, e) for t, s, e in _jieba.tokenize(text)]
-        return _merge_jieba_tokens(tokens)
-    return _fallback_boundaries(text)
+    """无 jieba 时按字符类型分组，返回各组词尾偏移的 array('I')"""
+    classes = text.translate(_CHAR_CLASSES)
+    return array("I", map(_match_end, _RUN_RE.finditer(classes)))
+
+def _fallback_run_end(text, pos):
+    """pos 所在同类字符段的结尾（fallback 模式下 pos 之后的第一个词尾）"""
+    n = 64
+    while True:
+        classes = text[pos:pos + n].translate(_CHAR_CLASSES)
+        end = _RUN_RE.match(classes).end()
+        if end < len(classes) or pos + n >= len(text):
+            return pos + end
+        n *= 2
+
+def _fallback_run_start(text, pos):
+    """pos - 1 所在同类字符段的开头（fallback 模式下 pos 之前的最后一个词首）"""
+    n = 64
+    while True:
+        start = max(pos - n, 0)
+        classes = text[start:pos].translate(_CHAR_CLASSES)[::-1]
+        length = _RUN_RE.match(classes).end()
+        if length < len(classes) or start == 0:
+            return pos - length
+        n *= 2
+
+# 子句分隔符：空白，以及不在 jieba 汉字/英文块字符集（re_han_default）里的标点。
+# jieba 一定在这些字符处切开，_merge_jieba_tokens 也一定在此断开，
+# 所以分隔符之间的子句可以单独分词，结果与整段分词完全一致。
+_CLAUSE_DELIM_RE = re.compile(
+    r"\r\n|[\s!\"$'-*,/:-@\[-^`{-~\u3000-\u303f\uff01-\uff0f\uff1a-\uff20]"
+)
+
+def _clause_groups(clause, mode="jieba"):
+    """单个子句在 mode（jieba / dict）下的合并结果（相对偏移的词尾 array），按子句文本缓存。
+    返回 (ends, absorbs_prev)：子句开头恰好是两个单字成段时，
+    _merge_jieba_tokens 会把它们吸附到前一个组上（即使中间隔着标点），
+    拼接时需要照做。
+    """
+    cache = _clause_cache(mode)
+    entry = cache.get(clause)
+    if entry is None:
+        ends, kinds = _token_ends(_jieba.cut(clause, HMM=mode == "jieba"))
+        absorbs_prev = (
+            len(kinds) >= 2 and kinds[0] == _SINGLE and kinds[1] == _SINGLE
+            and (len(kinds) == 2 or kinds[2] == _BREAK)
+        )
+        entry = (_merge_token_ends(ends, kinds), absorbs_prev)
+        cache.put(clause, entry)
+    return entry
 
-def next_word(text, pos):
-    for _, end in get_word_boundaries(text):
+# 惰性分词时单个子句的长度上限：更长的子句（无标点的长段中文、hex 串等）
+# 在 _LAZY_SPAN 的整数倍位置切开分别分词，切口附近的边界是近似的
+_LAZY_SPAN = 1024
+
+def _iter_clauses(text, start=0, span=0):
+    """从 start 起依次产出 (start, end, is_delim)：子句与分隔符交替出现。
+    span 大于 0 时，长于 span 的子句在 span 的整数倍位置切成几段"""
+    pos = start
+    for m in _CLAUSE_DELIM_RE.finditer(text, start):
+        a, b = m.span()
+        if a > pos:
+            yield from _split_clause(pos, a, span)
+        yield a, b, True
+        pos = b
+    if pos < len(text):
+        yield from _split_clause(pos, len(text), span)
+
+def _split_clause(a, b, span):
+    if span and b - a > span:
+        for cut in range((a // span + 1) * span, b, span):
+            yield a, cut, False
+            a = cut
+    yield a, b, False
+
+def _iter_jieba_ends(text, start=0, mode="jieba", span=0):
+    """从 start（0、某个分隔符的位置，或 span 切开长子句的位置）起按顺序惰性产出各组词尾。
+    最后一个组要等下一个子句确定是否吸附后才产出。
+    """
+    pending = None
+    cut = False
+    for a, b, is_delim in _iter_clauses(text, start, span):
+        if is_delim:
+            if pending is not None:
+                yield pending
+            pending = b
+            cut = False
+            continue
+        ends, absorbs_prev = _clause_groups(text[a:b], mode)
+        first = 0
+        # 切口处不吸附，前一段的最后一组照常结束
+        if absorbs_prev and pending is not None and not cut:
+            pending = ends[0] + a
+            first = 1
+        for k in range(first, len(ends)):
+            if pending is not None:
+                yield pending
+            pending = ends[k] + a
+        cut = True
+    if pending is not None:
+        yield pending
+
+def _jieba_boundaries(text, mode="jieba"):
+    return array("I", _iter_jieba_ends(text, 0, mode))
+
+def _delim_before(text, pos, span):
+    """pos 之前（不含 pos）最近的分隔符位置，没有则为 0。
+    从 pos 往回按窗口倍增搜索，最多找 span + 1 个字符：更远时 pos - 1 所在的子句
+    长于 span，会被 _iter_clauses 切开，改为返回 pos 之前最近的切口。
+    """
+    window = 256
+    hi = pos
+    bound = max(0, pos - span - 1)
+    while hi > bound:
+        lo = max(bound, hi - window)
+        last = None
+        for m in _CLAUSE_DELIM_RE.finditer(text, lo, hi):
+            last = m.start()
+        if last is not None:
+            # 窗口可能从 "\r\n" 中间切开
+            if text[last] == "\n" and last > 0 and text[last - 1] == "\r":
+                last -= 1
+            return last
+        hi = lo
+        window *= 2
+    return bound and (pos - 1) // span * span
+
+def _lazy_next_word(text, pos, mode):
+    if pos >= len(text):
+        return len(text)
+    if mode == "fallback":
+        return _fallback_run_end(text, max(pos, 0))
+    for end in _iter_jieba_ends(text, _delim_before(text, pos + 1, _LAZY_SPAN), mode, _LAZY_SPAN):
         if end > pos:
             return end
     return len(text)
 
-def prev_word(text, pos):
-    for start, _ in reversed(get_word_boundaries(text)):
-        if start < pos:
-            return start
-    return 0
+def _lazy_prev_word(text, pos, mode):
+    pos = min(pos, len(text))
+    if pos <= 0:
+        return 0
+    if mode == "fallback":
+        return _fallback_run_start(text, pos)
+    target = start = _delim_before(text, pos, _LAZY_SPAN)
+    for end in _iter_jieba_ends(text, start, mode, _LAZY_SPAN):
+        if start >= pos:
+            break
+        target, start = start, end
+    return target
 
-def handle_request(data):
+MODES = ("jieba", "dict", "fallback")
+# 需要 jieba 词典的模式
+_JIEBA_MODES = ("jieba", "dict")
+
+def serving_mode(requested=None):
+    """本次请求实际使用的模式：requested 或配置的 mode；jieba 加载完成前一律 fallback"""
+    mode = requested or _settings["mode"]
+    if mode not in MODES:
+        raise ValueError(f"unknown mode {mode}")
+    return mode if _jieba else "fallback"
+
+def _compute_boundaries(text, mode):
+    if mode in _JIEBA_MODES:
+        return _jieba_boundaries(text, mode)
+    return _fallback_boundaries(text)
+
+class WordIndex:
+    """词边界索引。各组首尾相接，只存升序的词尾偏移 array('I')，
+    第 i 组的词首就是第 i-1 组的词尾（第 0 组从 0 开始），按二分查找。
+    """
+    __slots__ = ("ends",)
+
+    def __init__(self, ends):
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __iter__(self):
+        start = 0
+        for end in self.ends:
+            yield start, end
+            start = end
+
+    def next_end(self, pos):
+        """pos 之后第一个词尾，没有则返回 None"""
+        i = bisect_right(self.ends, pos)
+        return self.ends[i] if i < len(self.ends) else None
+
+    def prev_start(self, pos):
+        """pos 之前最后一个词首，没有则返回 None"""
+        if pos <= 0 or not self.ends:
+            return None
+        # 最后一个词尾不是任何词的词首
+        i = min(bisect_left(self.ends, pos), len(self.ends) - 1)
+        return self.ends[i - 1] if i else 0
+
+_EMPTY_INDEX = WordIndex(array("I"))
+
+def word_index(text, mode=None):
+    if not text:
+        return _EMPTY_INDEX
+    mode = mode or serving_mode()
+    cache = _text_cache(mode)
+    index = cache.get(text)
+    if index is None:
+        # 只有真正分词时占用名额，命中缓存和状态查询不用排队
+        with _segment_slots:
+            index = WordIndex(_compute_boundaries(text, mode))
+            cache.put(text, index)
+    return index
+
+def get_word_boundaries(text, mode=None):
+    return list(word_index(text, mode))
+
+def _use_lazy(text, mode):
+    """长文本且尚未缓存完整边界时，只在光标附近按需分词"""
+    return len(text) > int(_settings["lazy_threshold"]) and _text_cache(mode).peek(text) is None
+
+def next_word(text, pos, mode=None):
+    mode = mode or serving_mode()
+    if _use_lazy(text, mode):
+        with _segment_slots:
+            return _lazy_next_word(text, pos, mode)
+    end = word_index(text, mode).next_end(pos)
+    return len(text) if end is None else end
+
+def prev_word(text, pos, mode=None):
+    mode = mode or serving_mode()
+    if _use_lazy(text, mode):
+        with _segment_slots:
+            return _lazy_prev_word(text, pos, mode)
+    start = word_index(text, mode).prev_start(pos)
+    return 0 if start is None else start
+
+def _parse_options(field):
+    options = {}
+    for item in field.split(","):
+        key, sep, value = item.strip().partition("=")
+        if key:
+            options[key] = value if sep else True
+    return options
+
+# 状态查询与存活检查：不分词、不占分词名额，也不算活动
+STATUS_ACTIONS = ("stats", "cache_info", "profile", "ping")
+
+def dispatch(text, pos, action, options=None):
+    """执行一个已解析的请求，返回响应（不含换行），并记入 _metrics"""
+    t0 = time.perf_counter()
+    # 查询状态和存活检查不算活动，监控不会让 daemon 一直常驻
+    if action not in STATUS_ACTIONS:
+        _activity.touch()
+    if _profile_switch.on() != (_profiler is not None):
+        _sync_profiling()
+    # 只读一次：其他连接或 SIGUSR2 随时可能关掉 profiling
+    profiler = _profiler
+    name = action.partition(":")[0]
     try:
-        parts = data.strip().split("\t")
-        if len(parts) != 3:
-            return "error: expected text\\tposition\\taction"
-        text, pos_str, action = parts
-        pos = int(pos_str)
-        if action == "next_word":
-            return str(next_word(text, pos))
-        elif action == "prev_word":
-            return str(prev_word(text, pos))
-        elif action == "delete_word":
-            target = prev_word(text, pos)
-            return f"{target},{pos}"
+        # 只 profile 分词请求，状态查询不会挤掉真正慢的请求
+        if profiler is None or name not in Tracer.ACTIONS:
+            result = _dispatch(text, pos, action, options or {})
         else:
-            return f"error: unknown action {action}"
+            result = profiler.run(_dispatch, text, pos, action, options or {})
+    except Exception as e:
+        result = f"error: {e}"
+    ms = (time.perf_counter() - t0) * 1000
+    _metrics.record(name, len(text), ms, result.startswith("error:"))
+    if _tracer is not None and name in Tracer.ACTIONS:
+        try:
+            mode = serving_mode((options or {}).get("mode"))
+            _tracer.record(text, pos, action, options, mode, ms, result)
+        except Exception:
+            pass
+    return result
+
+def _split_count(action):
+    """"next_word:3" → ("next_word", 3)，不带次数时为 1"""
+    name, sep, count = action.partition(":")
+    if not sep:
+        return name, 1
+    n = int(count)
+    if n < 1:
+        raise ValueError(f"bad repeat count {count}")
+    return name, n
+
+def _hop(step, text, pos, count, mode):
+    """连续跳 count 个词，到头后提前结束；整段已缓存时各跳共用同一份边界"""
+    for _ in range(count):
+        target = step(text, pos, mode)
+        if target == pos:
+            break
+        pos = target
+    return pos
+
+def _status(text, action):
+    if action == "ping":
+        return "pong"
+    if action == "cache_info":
+        return " ".join(f"{k}={v}" for k, v in cache_info().items())
+    if action == "stats":
+        return json.dumps(stats(), separators=(",", ":"))
+    if text in ("on", "off"):
+        set_profiling(text == "on")
+    return "on" if _profile_switch.on() else "off"
+
+def _dispatch(text, pos, action, options):
+    # 先答状态查询：不解析模式、不碰分词缓存，分词再忙也能立即回复
+    if action in STATUS_ACTIONS and not options.get("report"):
+        return _status(text, action)
+    mode = serving_mode(options.get("mode"))
+    if action in STATUS_ACTIONS:
+        return f"{_status(text, action)}\t{mode}"
+    action, count = _split_count(action)
+    if action == "next_word":
+        result = str(_hop(next_word, text, pos, count, mode))
+    elif action == "prev_word":
+        result = str(_hop(prev_word, text, pos, count, mode))
+    elif action == "delete_word":
+        target = _hop(prev_word, text, pos, count, mode)
+        result = f"{target},{pos}"
+    elif action == "boundaries":
+        result = " ".join(map(str, word_index(text, mode).ends))
+    else:
+        return f"error: unknown action {action}"
+    if options.get("report"):
+        result += f"\t{mode}"
+    return result
+
+def handle_request(data):
+    try:
+        parts = data.rstrip("\r\n").split("\t")
+        if len(parts) not in (3, 4):
+            return "error: expected text\\tposition\\taction[\\toptions]"
+        text, pos_str, action = parts[:3]
+        options = _parse_options(parts[3]) if len(parts) == 4 else {}
+        return dispatch(text, int(pos_str), action, options)
     except Exception as e:
         return f"error: {e}"
 
+KEEPALIVE_HELLO = b"PAW keepalive"
+KEEPALIVE_ACK = b"OK keepalive\n"
+V2_HELLO = b"PAW v2"
+V2_ACK = b"OK v2\n"
+
+def _respond(conn, line):
+    try:
+        result = handle_request(line.decode("utf-8"))
+    except Exception as e:
+        result = f"error: {e}"
+    conn.sendall((result + "\n").encode("utf-8"))
+
+# v2 帧缓冲区每次最多扩大的字节数；大帧结束后超过 _FRAME_KEEP 的缓冲区不再保留
+_FRAME_CHUNK = 1 << 20
+_FRAME_KEEP = 1 << 20
+
+def _read_frame(reader, buf, length):
+    """把 length 字节读进可复用的 buf，返回 (buf, 是否读满)。
+    buf 随实际到达的数据增长（每次扩大 max(已读字节数, _FRAME_CHUNK)），
+    不按 header 声明的长度预先分配，长度写错的客户端占不了多少内存"""
+    got = 0
+    while got < length:
+        if got == len(buf):
+            buf.extend(bytes(min(length - got, max(got, _FRAME_CHUNK))))
+        with memoryview(buf) as view:
+            n = reader.readinto(view[got:min(length, len(buf))])
+        if not n:
+            return buf, False
+        got += n
+    return buf, True
+
+class IdleConnections:
+    """正在等待下一个请求的长连接，按开始空闲的先后排列。连接数到 max_connections 时
+    serve_forever 关掉其中最久没用的一条给新连接腾位置（客户端会自动重连），
+    挂着不用的 shell 不会占满连接数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conns = OrderedDict()
+
+    def add(self, conn):
+        with self._lock:
+            self._conns[conn] = None
+
+    def discard(self, conn):
+        with self._lock:
+            self._conns.pop(conn, None)
+
+    def evict_oldest(self):
+        """关掉最久空闲的连接（其线程读到 EOF 后退出并释放名额）；没有空闲连接时返回 False"""
+        with self._lock:
+            if not self._conns:
+                return False
+            conn, _ = self._conns.popitem(last=False)
+        try: conn.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+        return True
+
+_idle_conns = IdleConnections()
+
+def _requests(conn, reader):
+    """逐行读长连接上的请求；等下一行期间连接登记为空闲，可被腾掉"""
+    while True:
+        _idle_conns.add(conn)
+        try:
+            line = reader.readline()
+        finally:
+            _idle_conns.discard(conn)
+        if not line:
+            return
+        yield line
+
+def _serve_v2(conn, reader):
+    """v2 帧：header "length\\tposition\\taction[\\toptions]\\n" 后跟 length 字节 UTF-8 文本"""
+    buf = bytearray(4096)
+    for header in _requests(conn, reader):
+        try:
+            fields = header.decode("ascii").rstrip("\r\n").split("\t")
+            length, pos, action = int(fields[0]), int(fields[1]), fields[2]
+            options = _parse_options(fields[3]) if len(fields) > 3 else {}
+            if length < 0:
+                raise ValueError(length)
+        except (ValueError, IndexError, UnicodeDecodeError):
+            # 帧边界已无法确定，只能断开
+            conn.sendall(b"error: expected length\\tposition\\taction[\\toptions]\n")
+            return
+        buf, complete = _read_frame(reader, buf, length)
+        if not complete:
+            return
+        try:
+            with memoryview(buf) as view:
+                text = str(view[:length], "utf-8")
+            if len(buf) > _FRAME_KEEP:
+                buf = bytearray(4096)
+            result = dispatch(text, pos, action, options)
+        except Exception as e:
+            result = f"error: {e}"
+        conn.sendall((result + "\n").encode("utf-8"))
+
+def serve_connection(conn):
+    """默认一问一答后关闭；首行为 PAW keepalive 时保持连接逐行按序应答，
+    为 PAW v2 时改用长度前缀帧"""
+    reader = conn.makefile("rb")
+    try:
+        line = reader.readline()
+        if not line:
+            return
+        hello = line.rstrip(b"\r\n")
+        if hello == V2_HELLO:
+            conn.sendall(V2_ACK)
+            conn.settimeout(float(_settings["keepalive_timeout"]))
+            _serve_v2(conn, reader)
+            return
+        if hello != KEEPALIVE_HELLO:
+            _respond(conn, line)
+            return
+        conn.sendall(KEEPALIVE_ACK)
+        conn.settimeout(float(_settings["keepalive_timeout"]))
+        for line in _requests(conn, reader):
+            _respond(conn, line)
+    finally:
+        reader.close()
+
+def _connection_thread(conn, slots):
+    try:
+        conn.settimeout(float(_settings["read_timeout"]))
+        serve_connection(conn)
+    except socket.timeout:
+        pass
+    except Exception as e:
+        try: conn.sendall(f"error: {e}\n".encode("utf-8"))
+        except: pass
+    finally:
+        conn.close()
+        slots.release()
+
+BUSY = b"error: busy\n"
+
+def serve_forever(sock):
+    """每个连接一个线程，读超时的慢客户端只占用自己的线程，不会阻塞其他 shell。
+    连接数到上限时先腾掉最久空闲的长连接；全都在忙就立即回 busy 并断开，
+    客户端马上退回自己的默认行为，而不是一直等在 accept 队列里"""
+    slots = threading.BoundedSemaphore(max(1, int(_settings["max_connections"])))
+    while True:
+        conn, _ = sock.accept()
+        if not slots.acquire(blocking=False):
+            if not (_idle_conns.evict_oldest() and slots.acquire(timeout=1)):
+                try: conn.sendall(BUSY)
+                except OSError: pass
+                conn.close()
+                continue
+        threading.Thread(target=_connection_thread, args=(conn, slots), daemon=True).start()
+
+def _load_jieba():
+    global _jieba, _jieba_state
+    try:
+        jieba = init_jieba()
+    except Exception as e:
+        print(f"jieba: failed to load ({e})")
+        jieba = None
+    if jieba:
+        _poll_userdict(jieba)
+    # 单次赋值即完成切换，之后的请求直接走 jieba
+    _jieba = jieba
+    _jieba_state = "loaded" if jieba else "unavailable"
+    print(f"jieba: {'loaded' if jieba else 'fallback mode'}")
+
+def _serve_metrics_conn(conn):
+    try:
+        conn.settimeout(float(_settings["read_timeout"]))
+        conn.sendall(prometheus_metrics().encode("utf-8"))
+    except OSError:
+        pass
+    except Exception as e:
+        # 单次抓取出错不能拖垮 supervisor 或指标线程
+        print(f"metrics error: {e}")
+    finally:
+        conn.close()
+
+def serve_metrics(sock):
+    """指标 socket：每个连接写出一份 Prometheus 文本后关闭"""
+    while True:
+        conn, _ = sock.accept()
+        _serve_metrics_conn(conn)
+
+def _poll_userdict(jieba):
+    try:
+        changed = _userdict.poll(jieba)
+        if changed:
+            print(f"userdict: applied {len(changed)} changed words")
+    except Exception as e:
+        print(f"userdict error: {e}")
+
+def watch_userdict(interval):
+    """轮询用户词典的 mtime；jieba 加载完成前不做任何事"""
+    while True:
+        time.sleep(interval)
+        if _jieba:
+            _poll_userdict(_jieba)
+
+def _start_watcher():
+    interval = float(_settings["userdict_poll"])
+    if interval > 0:
+        threading.Thread(target=watch_userdict, args=(interval,), name="userdict", daemon=True).start()
+
+def publish_cache_stats(interval):
+    """pre-fork worker：定期把本进程的缓存计数写进共享内存，供父进程汇总
+    （每个请求都写太贵，cache_info() 比一次缓存命中的请求还慢）"""
+    while True:
+        time.sleep(interval)
+        _metrics.publish_cache(cache_info())
+
+def _start_metrics(msock):
+    if msock is not None:
+        threading.Thread(target=serve_metrics, args=(msock,), name="metrics", daemon=True).start()
+
+# pre-fork 模式下的 worker：pid → (启动时间, 序号)
+_workers = {}
+_owner_pid = os.getpid()
+
+def _spawn_worker(sock, msock, slot):
+    pid = os.fork()
+    if pid == 0:
+        # worker：退出信号交给父进程统一处理，自己直接结束即可
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        code = 0
+        try:
+            # 指标由父进程汇总后统一提供
+            if msock is not None:
+                msock.close()
+            _metrics.use_slot(slot)
+            threading.Thread(target=publish_cache_stats, args=(1.0,), name="cache-stats",
+                             daemon=True).start()
+            _start_watcher()
+            _start_tracer(slot)
+            serve_forever(sock)
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+    _workers[pid] = (time.time(), slot)
+
+def _wait_worker(msock):
+    """等一个 worker 退出，返回 (pid, status)；期间在父进程里应答指标 socket"""
+    if msock is None:
+        return os.wait()
+    while True:
+        if select.select([msock], [], [], 1.0)[0]:
+            conn, _ = msock.accept()
+            _serve_metrics_conn(conn)
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            return pid, status
+
+def serve_prefork(sock, msock, processes, ready_fd=None):
+    """父进程只做监督：fork 出 processes 个 worker 共享监听 socket，
+    worker 退出后重新补上（启动即退出的 worker 延迟 1 秒再补，避免空转）。
+    指标按 worker 分格放在共享内存里，由父进程汇总应答"""
+    import gc
+    # 每个 worker 一格计数，重启的 worker 沿用原来那一格
+    _metrics.share(processes)
+    # 把已加载的 jieba 词典等对象移出 GC 跟踪，fork 后不会因 GC 扫描而触发写时复制
+    gc.freeze()
+    # jieba 已就绪、socket 已在监听；先关掉通知 fd，免得 worker 继承它
+    if ready_fd is not None:
+        notify_ready(ready_fd)
+    for slot in range(processes):
+        _spawn_worker(sock, msock, slot)
+    print(f"Started {processes} workers: {' '.join(map(str, _workers))}")
+    while True:
+        pid, status = _wait_worker(msock)
+        worker = _workers.pop(pid, None)
+        if worker is None:
+            continue
+        started, slot = worker
+        print(f"Worker {pid} exited (status {status}), restarting")
+        if time.time() - started < 1:
+            time.sleep(1)
+        _spawn_worker(sock, msock, slot)
+
+def _memory_pressure():
+    """系统是否处于内存压力：Linux 读 PSI，macOS 读 kern.memorystatus_vm_pressure_level；
+    无法判断时视为没有压力"""
+    try:
+        with open("/proc/pressure/memory") as f:
+            # some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+            return float(f.readline().split()[1].partition("=")[2]) >= 10
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import subprocess
+        r = subprocess.run(["sysctl", "-n", "kern.memorystatus_vm_pressure_level"],
+                           capture_output=True, text=True, timeout=2)
+        # 1 正常，2 警告，4 严重
+        return int(r.stdout.strip()) >= 2
+    except Exception:
+        return False
+
+def _should_exit(policy, idle_s, limit_s):
+    if idle_s < limit_s:
+        return False
+    return policy == "idle" or (policy == "memory-pressure" and _memory_pressure())
+
+def watch_idle(policy, limit_s):
+    """空闲超时后给自己发 SIGTERM，由 cleanup 删除 socket/pid 文件后退出；
+    下一个请求连接失败时客户端会重新拉起 daemon"""
+    interval = min(60.0, max(1.0, limit_s / 4))
+    while True:
+        time.sleep(interval)
+        idle_s = _activity.idle_seconds()
+        if _should_exit(policy, idle_s, limit_s):
+            print(f"Idle for {idle_s:.0f}s ({policy}), exiting")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+def _start_idle_watcher():
+    policy = _settings["idle_policy"]
+    if policy in ("idle", "memory-pressure"):
+        limit_s = float(_settings["idle_minutes"]) * 60
+        threading.Thread(target=watch_idle, args=(policy, limit_s), name="idle", daemon=True).start()
+
+def notify_ready(fd):
+    """告诉启动方 socket 已可连接，然后关闭通知 fd"""
+    try: os.write(fd, b"ready\n")
+    except OSError: pass
+    try: os.close(fd)
+    except OSError: pass
+
 def cleanup(*_):
-    for f in (SOCKET_PATH, PID_FILE):
+    if os.getpid() != _owner_pid:
+        os._exit(0)
+    for pid in list(_workers):
+        try: os.kill(pid, signal.SIGTERM)
+        except OSError: pass
+    for f in (SOCKET_PATH, METRICS_SOCKET_PATH, PID_FILE):
         try: os.unlink(f)
         except: pass
     sys.exit(0)
 
-def main():
-    global _jieba
+def main(ready_fd=None):
+    global _owner_pid
+    _owner_pid = os.getpid()
+    # 脱离启动它的终端会话，关掉那个终端不会带走 daemon
+    try: os.setsid()
+    except OSError: pass
     os.makedirs(os.path.dirname(SOCKET_PATH), exist_ok=True)
 
     # Check existing instance
@@ -188,37 +1788,53 @@ def main():
         except (ProcessLookupError, ValueError):
             pass
 
-    # Clean up old socket
-    try: os.unlink(SOCKET_PATH)
-    except FileNotFoundError: pass
+    # Clean up old sockets
+    for path in (SOCKET_PATH, METRICS_SOCKET_PATH):
+        try: os.unlink(path)
+        except FileNotFoundError: pass
 
-    _jieba = init_jieba()
-    print(f"jieba: {'loaded' if _jieba else 'fallback mode'}")
+    configure(load_config())
 
     signal.signal(signal.SIGTERM, cleanup)
     signal.signal(signal.SIGINT, cleanup)
+    signal.signal(signal.SIGUSR2, _toggle_profiling)
+
+    profile_env = os.environ.get("PAW_PROFILE", "")
+    if profile_env not in ("", "0"):
+        set_profiling(True, int(profile_env) if profile_env.isdigit() else None)
 
     with open(PID_FILE, "w") as f:
         f.write(str(os.getpid()))
 
     sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     sock.bind(SOCKET_PATH)
-    sock.listen(5)
+    sock.listen(int(_settings["backlog"]))
     print(f"Listening on {SOCKET_PATH}")
 
+    msock = None
+    if _settings["metrics_socket"]:
+        msock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        msock.bind(METRICS_SOCKET_PATH)
+        msock.listen(8)
+        print(f"Metrics on {METRICS_SOCKET_PATH}")
+
+    processes = int(_settings["processes"])
+    _activity.touch()
+    _start_idle_watcher()
     try:
-        while True:
-            conn, _ = sock.accept()
-            try:
-                data = conn.recv(65536).decode("utf-8")
-                if data:
-                    result = handle_request(data)
-                    conn.sendall((result + "\n").encode("utf-8"))
-            except Exception as e:
-                try: conn.sendall(f"error: {e}\n".encode("utf-8"))
-                except: pass
-            finally:
-                conn.close()
+        if processes > 0:
+            # fork 之前同步加载 jieba，worker 通过写时复制共享词典；期间请求在 backlog 中排队
+            _load_jieba()
+            serve_prefork(sock, msock, processes, ready_fd)
+        else:
+            _start_metrics(msock)
+            _start_watcher()
+            _start_tracer()
+            # socket 先就绪，jieba 在后台加载，期间用 _fallback_boundaries 应答
+            threading.Thread(target=_load_jieba, name="jieba-loader", daemon=True).start()
+            if ready_fd is not None:
+                notify_ready(ready_fd)
+            serve_forever(sock)
     finally:
         cleanup()
 
@@ -230,5 +1846,11 @@ if __name__ == "__main__":
             print("Stopped")
         else:
             print("Not running")
+    elif len(sys.argv) > 1 and sys.argv[1] == "compile-dict":
+        import jieba
+        compile_dict(jieba, sys.argv[2] if len(sys.argv) > 2 else DICT_FILE)
+        print("Compiled")
+    elif len(sys.argv) > 2 and sys.argv[1] == "--ready-fd":
+        main(ready_fd=int(sys.argv[2]))
     else:
         main()